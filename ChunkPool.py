@@ -0,0 +1,56 @@
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from multiprocessing.shared_memory import SharedMemory
+
+
+_arrays = {}		# arrays of the parent process, as seen by a worker
+_blocks = []		# shared memory blocks mapped by this worker (kept open while it runs)
+
+
+def attach(specs):
+	""" Pool initializer : map the shared memory blocks of the parent process (name, shape, dtype) """
+	for key, (name, shape, dtype) in specs.items():
+		shm = SharedMemory(name=name)		# the parent process unlinks it
+		_blocks.append(shm)
+		_arrays[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def call(func, c1, c2, params):
+	return func(_arrays, c1, c2, params)
+
+
+def get_chunks(T, chunk_size):
+	return [(c1, min(c1 + chunk_size, T)) for c1 in range(0, T, chunk_size)]
+
+
+def map_chunks(func, arrays, params, T, chunk_size, n_workers=1):
+	"""
+	Run func(arrays, c1, c2, params) for every chunk [c1, c2) of frames [0, T)
+	With n_workers > 1 (None : all cores) the chunks are shared among worker processes, and arrays (dict of numpy arrays)
+	are put in shared memory instead of being pickled for every chunk.
+
+	:return: list of (c1, c2, result) in chunk order
+	"""
+	chunks = get_chunks(T, chunk_size)
+	if n_workers is None: n_workers = cpu_count()
+
+	if n_workers <= 1 or len(chunks) <= 1:
+		return [(c1, c2, func(arrays, c1, c2, params)) for c1, c2 in chunks]
+
+	blocks, specs = [], {}
+	try:
+		for key, arr in arrays.items():
+			arr = np.ascontiguousarray(arr)
+			shm = SharedMemory(create=True, size=max(1, arr.nbytes))
+			blocks.append(shm)
+			np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+			specs[key] = (shm.name, arr.shape, arr.dtype.str)
+
+		with Pool(min(n_workers, len(chunks)), initializer=attach, initargs=(specs,)) as pool:
+			res = pool.starmap(call, [(func, c1, c2, params) for c1, c2 in chunks])
+	finally:
+		for shm in blocks:
+			shm.close()
+			shm.unlink()
+
+	return [(c1, c2, r) for (c1, c2), r in zip(chunks, res)]
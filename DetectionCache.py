@@ -0,0 +1,211 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+from DetectionStore import DetectionStore
+from suren.util import eprint
+
+
+def file_fingerprint(path, chunk=1 << 20, samples=3):
+	"""
+	Content hash of a file from its size and chunks sampled across it (fast on large videos / weights)
+	"""
+	size = os.path.getsize(path)
+	h = hashlib.sha1(str(size).encode())
+	with open(path, 'rb') as f:
+		for i in range(samples):
+			f.seek(max(size - chunk, 0) * i // max(samples - 1, 1))
+			h.update(f.read(chunk))
+	return h.hexdigest()
+
+
+def fingerprint(path):
+	"""
+	Content hash of a file, or of a directory (image sequence, saved model) from its files and their relative paths.
+	Renaming or moving it does not change the hash
+	"""
+	if not os.path.isdir(path):
+		return file_fingerprint(path)
+
+	h = hashlib.sha1()
+	for root, dirs, files in os.walk(path):
+		dirs.sort()
+		for name in sorted(files):
+			file_name = os.path.join(root, name)
+			h.update(os.path.relpath(file_name, path).encode())
+			h.update(file_fingerprint(file_name).encode())
+	return h.hexdigest()
+
+
+class DetectionCache:
+	"""
+	Detector + tracker outputs (NNHandler_yolo.create_yolo) addressed by the content of the video and the parameters
+	of the handler, so that a result is reused only if it was made from the same frames with the same model and
+	thresholds. Entries are DetectionStore directories. The least recently used ones are removed when the cache
+	grows over max_bytes.
+	"""
+
+	FORMAT = 1		# changes every key
+
+	ROOT = "./data/cache/detections"
+	MAX_BYTES = 2 << 30
+
+	# Handler attributes the detections depend on
+	PARAMS = ["class_names", "iou_thresh", "score_thresh", "input_size", "max_cosine_distance", "nn_budget",
+			  "nms_max_overlap", "is_tracked"]
+	MODELS = ["weigths_filename", "model_filename"]
+
+	def __init__(self, root=None, max_bytes=None):
+		self.root = DetectionCache.ROOT if root is None else root
+		self.max_bytes = DetectionCache.MAX_BYTES if max_bytes is None else max_bytes
+
+		self.fingerprints = {}		# (path, size, mtime) -> hash : files are hashed once per run
+
+	def fingerprint(self, path):
+		stat = os.stat(path)
+		k = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+		if k not in self.fingerprints:
+			self.fingerprints[k] = fingerprint(path)
+		return self.fingerprints[k]
+
+	def describe(self, handler, img_handle, **kwargs):
+		"""
+		:param kwargs: create_yolo arguments that change its output (temp_name)
+		:return: what the key is made of (json types)
+		"""
+		desc = {
+			"format": DetectionCache.FORMAT,
+			"handler": type(handler).__name__,
+			"video": self.fingerprint(img_handle.img_loc),
+			"frames": img_handle.time_series_length,
+			"params": {p: getattr(handler, p, None) for p in DetectionCache.PARAMS},
+			"models": {},
+			"args": kwargs
+		}
+		for m in DetectionCache.MODELS:
+			path = getattr(handler, m, None)
+			if path is not None:
+				# Missing model : its name (not the path, which depends on where the repo is)
+				path = self.fingerprint(path) if os.path.exists(path) else os.path.basename(os.path.normpath(path))
+			desc["models"][m] = path
+
+		return desc
+
+	@staticmethod
+	def key(desc):
+		""" :param desc: describe() """
+		return hashlib.sha1(json.dumps(desc, sort_keys=True).encode()).hexdigest()
+
+	def entry(self, key):
+		return os.path.join(self.root, key + DetectionStore.EXT)
+
+	def get(self, key):
+		"""
+		:return: DetectionStore directory of key, or None
+		"""
+		dir_name = self.entry(key)
+		if not DetectionStore.is_store(dir_name): return None
+
+		os.utime(os.path.join(dir_name, "detections.json"))		# recently used
+		return dir_name
+
+	def put(self, key, handler, desc=None, overwrite=False):
+		"""
+		Store the detections of handler (after create_yolo) under key, then evict
+		:param overwrite: Replace the entry of key if there is one (else it is kept)
+		:return: DetectionStore directory of key
+		"""
+		json_data = handler.json_data
+		if json_data is None:
+			json_data = {str(t): dets for t, dets in handler.get_frames()}
+		store = json_data
+		if not isinstance(store, DetectionStore):
+			store = DetectionStore.from_dict(json_data, handler.time_series_length)
+
+		# Written aside and renamed : an entry is complete or absent
+		dir_name = self.entry(key)
+		temp_name = "%s.tmp-%d" % (dir_name, os.getpid())
+		store.save(temp_name)
+		if desc is not None:
+			with open(os.path.join(temp_name, "cache.json"), 'w') as f:
+				json.dump(desc, f, indent=4)
+
+		if overwrite and os.path.exists(dir_name):
+			# Moved away first : os.replace does not replace a directory that is not empty
+			old_name = "%s.old-%d" % (dir_name, os.getpid())
+			os.replace(dir_name, old_name)
+			shutil.rmtree(old_name, ignore_errors=True)
+
+		try:
+			os.replace(temp_name, dir_name)
+		except OSError:
+			shutil.rmtree(temp_name)		# made by another run in the meantime
+
+		self.evict(keep=dir_name)
+		return dir_name
+
+	def entries(self):
+		"""
+		:return: list of (last use, bytes, directory), least recently used first
+		"""
+		if not os.path.isdir(self.root): return []
+
+		out = []
+		for name in os.listdir(self.root):
+			dir_name = os.path.join(self.root, name)
+			if not name.endswith(DetectionStore.EXT) or not DetectionStore.is_store(dir_name): continue
+
+			size = sum(os.path.getsize(os.path.join(dir_name, f)) for f in os.listdir(dir_name))
+			out.append((os.path.getmtime(os.path.join(dir_name, "detections.json")), size, dir_name))
+		return sorted(out)
+
+	def size(self):
+		return sum(size for _, size, _ in self.entries())
+
+	def evict(self, keep=None):
+		"""
+		Remove the least recently used entries until the cache fits in max_bytes
+		:param keep: entry never removed (the one just written)
+		"""
+		entries = self.entries()
+		total = sum(size for _, size, _ in entries)
+		for _, size, dir_name in entries:
+			if total <= self.max_bytes: break
+			if dir_name == keep: continue
+
+			shutil.rmtree(dir_name, ignore_errors=True)
+			total -= size
+
+	def clear(self):
+		for _, _, dir_name in self.entries():
+			shutil.rmtree(dir_name, ignore_errors=True)
+
+
+# Detection cache of NNHandler_yolo.create_or_load
+# 	python DetectionCache.py					(list the entries)
+# 	python DetectionCache.py --max_gb 1		(evict down to 1 GB)
+# 	python DetectionCache.py --clear
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--root", "-r", type=str, dest="root", default=DetectionCache.ROOT)
+	parser.add_argument("--max_gb", type=float, dest="max_gb", default=None)
+	parser.add_argument("--clear", action="store_true", dest="clear")
+	args = parser.parse_args()
+
+	cache = DetectionCache(args.root, None if args.max_gb is None else int(args.max_gb * (1 << 30)))
+	if args.clear:
+		cache.clear()
+	elif args.max_gb is not None:
+		cache.evict()
+
+	for _, size, dir_name in cache.entries():
+		try:
+			with open(os.path.join(dir_name, "cache.json")) as f:
+				desc = json.load(f)
+			print("%s : %s, %s frames, %.1f MB" % (os.path.basename(dir_name), desc["handler"], desc["frames"], size / 1e6))
+		except (OSError, ValueError, KeyError) as e:
+			eprint(dir_name, e)
+	print("Total : %.1f MB" % (cache.size() / 1e6))
@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+import numpy as np
+
+from suren.util import eprint
+
+
+class DetectionStore:
+	"""
+	Detections of a video as one record table in frame order, with a frame index :
+	records[offsets[t] : offsets[t+1]] are the detections of frame t.
+
+	On disk (save / load) it is a directory : detections.json (frames, fields, string tables), records.npy, offsets.npy.
+	The arrays are memory mapped, so opening a store and reading a frame does not parse the whole file.
+
+	Reads like json_data (frame -> list of detection dicts, "t" or t as key), so it can stand in for it in the handlers.
+	Only frames with detections are keys (as in the json files).
+	"""
+
+	FORMAT = 1		# version of the layout
+	EXT = ".det"	# NNHandler_yolo.save_json writes a store for file names with this extension
+
+	DEFAULT_DTYPE = [("x1", np.float64), ("y1", np.float64), ("x2", np.float64), ("y2", np.float64), ("id", np.int64)]	# files without detections
+
+	def __init__(self, records, offsets, strings=None):
+		"""
+		:param records: structured array of detections, in frame order
+		:param offsets: T + 1 frame offsets into records
+		:param strings: {field : list of str} for str fields (records hold indices into the list)
+		"""
+		self.records = records
+		self.offsets = offsets
+		self.strings = {} if strings is None else strings
+
+		self.fields = list(records.dtype.names)
+		self.time_series_length = len(offsets) - 1
+
+	def __len__(self):
+		return int(np.count_nonzero(np.diff(self.offsets)))
+
+	def _frame(self, key):
+		t = int(key)
+		if t < 0 or t >= self.time_series_length: return None
+		a, b = self.offsets[t], self.offsets[t + 1]
+		return None if a == b else (t, a, b)
+
+	def __contains__(self, key):
+		try:
+			return self._frame(key) is not None
+		except (TypeError, ValueError):
+			return False
+
+	def __getitem__(self, key):
+		f = self._frame(key)
+		if f is None: raise KeyError(key)
+		return self.to_dicts(self.records[f[1]:f[2]])
+
+	def get(self, key, default=None):
+		return self[key] if key in self else default
+
+	def __iter__(self):
+		""" Frames with detections, as str (the keys of json_data) """
+		for t in np.nonzero(np.diff(self.offsets))[0]:
+			yield str(t)
+
+	def keys(self):
+		return list(self)
+
+	def items(self, start_time=None, end_time=None):
+		"""
+		Range scan
+		:return: iterator of (frame_index, detections) for the frames in [start_time, end_time) with detections
+		"""
+		if start_time is None: start_time = 0
+		if end_time is None: end_time = self.time_series_length
+		start_time, end_time = max(start_time, 0), min(end_time, self.time_series_length)
+		if start_time >= end_time: return
+
+		offsets = self.offsets[start_time:end_time + 1]
+		rows = self.to_dicts(self.records[offsets[0]:offsets[-1]])
+		offsets = offsets - offsets[0]
+		for t in np.nonzero(np.diff(offsets))[0]:
+			yield start_time + int(t), rows[offsets[t]:offsets[t + 1]]
+
+	def frame_records(self, start_time, end_time=None):
+		"""
+		:return: records of frames [start_time, end_time) (a view), and the frame of each record
+		"""
+		if end_time is None: end_time = start_time + 1
+		offsets = self.offsets[start_time:end_time + 1]
+		frames = np.repeat(np.arange(start_time, end_time), np.diff(offsets))
+		return self.records[offsets[0]:offsets[-1]], frames
+
+	def to_dicts(self, records):
+		""" Records as detection dicts (json types, keys in field order) """
+		rows = records.tolist()
+		if self.strings:
+			str_col = [(i, self.strings[f]) for i, f in enumerate(self.fields) if f in self.strings]
+			rows = [list(r) for r in rows]
+			for r in rows:
+				for i, table in str_col:
+					r[i] = table[r[i]]
+		return [dict(zip(self.fields, r)) for r in rows]
+
+	def to_dict(self):
+		""" json_data of the store ({"t" : [detections]}) """
+		return {str(t): dets for t, dets in self.items()}
+
+	@staticmethod
+	def from_dict(json_data, time_series_length):
+		"""
+		:param json_data: {t or "t" : [detection dicts]} as read from / written to the json files
+		"""
+		frames = sorted((int(t), t) for t in json_data)
+		if frames and (frames[0][0] < 0 or frames[-1][0] >= time_series_length):
+			raise ValueError("Frames out of range [0, %d)" % time_series_length)
+
+		dets = [bbox for _, t in frames for bbox in json_data[t]]
+		count = np.zeros(time_series_length, dtype=np.int64)
+		for t, key in frames:
+			count[t] = len(json_data[key])
+
+		offsets = np.zeros(time_series_length + 1, dtype=np.int64)
+		np.cumsum(count, out=offsets[1:])
+
+		if not dets:
+			return DetectionStore(np.zeros(0, dtype=DetectionStore.DEFAULT_DTYPE), offsets)
+
+		fields = list(dets[0].keys())
+		dtype, strings, columns = [], {}, []
+		for f in fields:
+			try:
+				col = [bbox[f] for bbox in dets]
+			except KeyError:
+				raise ValueError("Detections do not have the same fields (%s missing)" % f)
+
+			kinds = set(map(type, col))
+			if kinds <= {str}:
+				# Categorical : str fields are stored as indices into a table
+				table, col = np.unique(np.array(col, dtype=str), return_inverse=True)
+				strings[f] = table.tolist()
+				dtype.append((f, np.int32))
+			elif kinds <= {bool}:
+				dtype.append((f, np.bool_))
+			elif kinds <= {int, bool}:
+				dtype.append((f, np.int64))
+			elif kinds <= {int, float}:
+				dtype.append((f, np.float64))
+			else:
+				raise ValueError("Field %s has unsupported types : %s" % (f, kinds))
+			columns.append(col)
+
+		records = np.zeros(len(dets), dtype=dtype)
+		for f, col in zip(fields, columns):
+			records[f] = col
+
+		return DetectionStore(records, offsets, strings)
+
+	def save(self, dir_name):
+		if not os.path.exists(dir_name): os.makedirs(dir_name)
+
+		np.save(os.path.join(dir_name, "records.npy"), self.records)
+		np.save(os.path.join(dir_name, "offsets.npy"), self.offsets)
+
+		header = {
+			"format": DetectionStore.FORMAT,
+			"frames": self.time_series_length,
+			"fields": self.fields,
+			"strings": self.strings
+		}
+		with open(os.path.join(dir_name, "detections.json"), 'w') as f:
+			json.dump(header, f)
+
+	@staticmethod
+	def load(dir_name, mmap_mode='r'):
+		with open(os.path.join(dir_name, "detections.json")) as f:
+			header = json.load(f)
+
+		if header["format"] != DetectionStore.FORMAT:
+			raise ValueError("Unknown detection store format %s : %s" % (header["format"], dir_name))
+
+		records = np.load(os.path.join(dir_name, "records.npy"), mmap_mode=mmap_mode)
+		offsets = np.load(os.path.join(dir_name, "offsets.npy"))		# small, and read for every frame
+
+		return DetectionStore(records, offsets, header["strings"])
+
+	@staticmethod
+	def is_store(name):
+		return os.path.isdir(name) and os.path.exists(os.path.join(name, "detections.json"))
+
+	@staticmethod
+	def json_to_store(json_file, dir_name):
+		with open(json_file, 'r') as f:
+			data = json.load(f)
+		frames = data.pop("frames")
+		data = {t: dets for t, dets in data.items() if isinstance(dets, list)}
+
+		store = DetectionStore.from_dict(data, frames)
+		store.save(dir_name)
+		return store
+
+	@staticmethod
+	def store_to_json(dir_name, json_file):
+		store = DetectionStore.load(dir_name)
+		data = {"frames": store.time_series_length}
+		data.update(store.to_dict())
+
+		with open(json_file, 'w') as f:
+			json.dump(data, f, indent=4)
+
+
+# Convert detector outputs between the json format and the binary store
+# 	python DetectionStore.py -i data/labels/DEEE/yolo/cctv1-yolo.json -o data/labels/DEEE/yolo/cctv1-yolo.det
+# 	python DetectionStore.py -i data/labels/DEEE/yolo/cctv1-yolo.det -o data/labels/DEEE/yolo/cctv1-yolo.json
+# 	python DetectionStore.py -i data/labels			(every json file under the directory, to a store next to it)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--input", "-i", type=str, dest="input", default="./data/labels")
+	parser.add_argument("--output", "-o", type=str, dest="output", default=None)
+	parser.add_argument("--overwrite", "--ow", action="store_true", dest="overwrite")
+	args = parser.parse_args()
+
+	if DetectionStore.is_store(args.input):
+		DetectionStore.store_to_json(args.input, args.output or args.input[:-len(DetectionStore.EXT)] + ".json")
+
+	elif os.path.isdir(args.input):
+		for root, dirs, files in os.walk(args.input):
+			dirs[:] = [d for d in dirs if not d.endswith(DetectionStore.EXT)]
+			for name in sorted(files):
+				if not name.endswith(".json"): continue
+
+				json_file = os.path.join(root, name)
+				dir_name = json_file[:-len(".json")] + DetectionStore.EXT
+				if os.path.exists(dir_name) and not args.overwrite: continue
+
+				try:
+					store = DetectionStore.json_to_store(json_file, dir_name)
+					print("%s -> %s (%d detections)" % (json_file, dir_name, len(store.records)))
+				except (ValueError, KeyError) as e:
+					eprint("Skipped %s :" % json_file, e)
+
+	else:
+		DetectionStore.json_to_store(args.input, args.output or args.input[:-len(".json")] + DetectionStore.EXT)
@@ -0,0 +1,468 @@
+import os
+import sys
+import numpy as np
+import cv2
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from suren.util import eprint
+
+# Backends of NNHandler_yolo.create_yolo : a detector finds the boxes of a batch of frames, and a tracker turns the boxes
+# of each frame (in frame order) into the detection dicts that are saved ({"x1", "y1", "x2", "y2", "id", "name"})
+# 	TensorFlow : YoloDetector + DeepSortTracker (yolov4-deepsort)
+# 	Synthetic : SyntheticDetector + SyntheticTracker on a SyntheticCrowd, with SyntheticVideo as the video (no models)
+
+# TensorFlow and deepsort are only imported when a TensorFlow backend is created (they take seconds to import)
+SUBMODULE_DIR = os.path.dirname(os.path.realpath(__file__)) + "/submodules/yolov4-deepsort"
+
+
+def add_submodule_path():
+	""" yolov4-deepsort (core, deep_sort, tools) """
+	if SUBMODULE_DIR not in sys.path:
+		sys.path.append(SUBMODULE_DIR)
+
+
+class DetectorBackend:
+	def detect(self, frames, frame_indices):
+		"""
+		:param frames: list of RGB frames
+		:param frame_indices: frame index of each frame
+		:return: list of (bboxes (N x 4 : xmin, ymin, width, height in pixels), scores, classes), one per frame
+		"""
+		raise NotImplementedError
+
+	def close(self):
+		""" Release what the detector holds (threads) """
+		pass
+
+
+class TrackerBackend:
+	def update(self, t, frame, detections):
+		"""
+		Called for every frame, in order
+		:param detections: (bboxes, scores, classes) of the frame (DetectorBackend.detect)
+		:return: list of detection dicts {"x1", "y1", "x2", "y2", "id"} (id -1 if not tracked), with the class "name"
+			for confirmed tracks
+		"""
+		raise NotImplementedError
+
+
+class FramePreprocessor:
+	"""
+	Frames -> model input (resized, scaled to [0, 1], float32). The frames of a batch are processed in a thread pool
+	(OpenCV releases the GIL) and written into buffers kept between calls, so that no full size temporary is made
+	"""
+
+	def __init__(self, input_size, workers=None):
+		"""
+		:param workers: Threads (None : cpu count, 1 : no pool)
+		"""
+		self.input_size = input_size
+		self.workers = os.cpu_count() if workers is None else workers
+		self.pool = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+
+		self.batch = np.empty((0, input_size, input_size, 3), dtype=np.float32)
+		self.resized = np.empty((0, input_size, input_size, 3), dtype=np.uint8)
+
+	def alloc(self, n):
+		if n > len(self.batch):
+			self.batch = np.empty((n, self.input_size, self.input_size, 3), dtype=np.float32)
+			self.resized = np.empty((n, self.input_size, self.input_size, 3), dtype=np.uint8)
+
+	def process(self, i, frame):
+		cv2.resize(frame, (self.input_size, self.input_size), dst=self.resized[i])
+		np.divide(self.resized[i], 255., out=self.batch[i], casting='same_kind')
+
+	def __call__(self, frames):
+		"""
+		:return: n x input_size x input_size x 3 (float32). A view of the buffer : the next call overwrites it
+		"""
+		n = len(frames)
+		self.alloc(n)
+		if self.pool is None or n == 1:
+			for i, frame in enumerate(frames):
+				self.process(i, frame)
+		else:
+			list(self.pool.map(self.process, range(n), frames))
+		return self.batch[:n]
+
+	def close(self):
+		if self.pool is not None:
+			self.pool.shutdown()
+			self.pool = None
+
+
+class YoloDetector(DetectorBackend):
+	"""
+	YOLOv4 saved model (TensorFlow, yolov4-deepsort). A batch of frames goes through one model call and one
+	combined non max suppression
+	"""
+
+	def __init__(self, weights, input_size=416, iou_thresh=.45, score_thresh=.5, max_boxes=50, preprocess_workers=None):
+		"""
+		:param preprocess_workers: Threads resizing the frames (FramePreprocessor)
+		"""
+		add_submodule_path()
+		import tensorflow as tf
+		from tensorflow.python.saved_model import tag_constants
+		import core.utils as utils
+
+		self.tf = tf
+		self.utils = utils
+
+		self.input_size = input_size
+		self.iou_thresh = iou_thresh
+		self.score_thresh = score_thresh
+		self.max_boxes = max_boxes
+		self.preprocess = FramePreprocessor(input_size, preprocess_workers)
+
+		saved_model_loaded = tf.saved_model.load(weights, tags=[tag_constants.SERVING])
+		self.infer = saved_model_loaded.signatures['serving_default']
+
+	def detect(self, frames, frame_indices=None):
+		tf = self.tf
+
+		pred_bbox = self.infer(tf.constant(self.preprocess(frames)))
+		for key, value in pred_bbox.items():
+			boxes = value[:, :, 0:4]
+			pred_conf = value[:, :, 4:]
+
+		boxes, scores, classes, valid_detections = tf.image.combined_non_max_suppression(
+			boxes=tf.reshape(boxes, (tf.shape(boxes)[0], -1, 1, 4)),
+			scores=tf.reshape(
+				pred_conf, (tf.shape(pred_conf)[0], -1, tf.shape(pred_conf)[-1])),
+			max_output_size_per_class=self.max_boxes,
+			max_total_size=self.max_boxes,
+			iou_threshold=self.iou_thresh,
+			score_threshold=self.score_thresh
+		)
+
+		# convert data to numpy arrays and slice out unused elements
+		boxes, scores, classes = boxes.numpy(), scores.numpy(), classes.numpy()
+		valid_detections = valid_detections.numpy()
+
+		out = []
+		for i, frame in enumerate(frames):
+			n = int(valid_detections[i])
+			original_h, original_w, _ = frame.shape
+			bboxes = self.utils.format_boxes(boxes[i, :n], original_h, original_w)
+			out.append((bboxes, scores[i, :n], classes[i, :n]))
+		return out
+
+	def close(self):
+		self.preprocess.close()
+
+
+class FixedDetector(DetectorBackend):
+	"""
+	Stand in for a model : the same boxes for every frame. Counts its calls (to check the batching)
+	"""
+
+	def __init__(self, bboxes, scores=None, classes=None):
+		"""
+		:param bboxes: N x 4 (xmin, ymin, width, height in pixels)
+		"""
+		self.bboxes = np.array(bboxes, dtype=np.float32).reshape((-1, 4))
+		self.scores = np.ones(len(self.bboxes), dtype=np.float32) if scores is None else np.array(scores, dtype=np.float32)
+		self.classes = np.zeros(len(self.bboxes), dtype=np.float32) if classes is None else np.array(classes, dtype=np.float32)
+
+		self.calls = 0
+		self.batch_sizes = []
+
+	def detect(self, frames, frame_indices=None):
+		self.calls += 1
+		self.batch_sizes.append(len(frames))
+		return [(self.bboxes.copy(), self.scores.copy(), self.classes.copy()) for _ in frames]
+
+
+def detect_batches(frames, detector, batch_size=1):
+	"""
+	Run detector.detect on batches of batch_size frames (the last one may be shorter)
+	:param frames: iterator of (frame_index, frame)
+	:return: iterator of (frame_index, frame, (bboxes, scores, classes)), in frame order
+	"""
+	def run(batch):
+		ts, images = map(list, zip(*batch))
+		return zip(ts, images, detector.detect(images, ts))
+
+	batch = []
+	for item in frames:
+		batch.append(item)
+		if len(batch) < batch_size: continue
+
+		yield from run(batch)
+		batch = []
+
+	if batch: yield from run(batch)
+
+
+class DeepSortTracker(TrackerBackend):
+	"""
+	Appearance features of the boxes (mars-small128), non max suppression and deepsort tracking (yolov4-deepsort)
+	"""
+
+	def __init__(self, model_filename, is_tracked=True, class_names=None, nms_max_overlap=1.0, max_cosine_distance=0.4,
+				 nn_budget=None, encoder_batch_size=32, debug=False):
+		add_submodule_path()
+		from deep_sort import preprocessing, nn_matching
+		from deep_sort.detection import Detection
+		from deep_sort.tracker import Tracker
+		from tools import generate_detections as gdet
+
+		self.preprocessing = preprocessing
+		self.Detection = Detection
+
+		self.is_tracked = is_tracked
+		self.class_names = class_names
+		self.nms_max_overlap = nms_max_overlap
+		self.debug = debug
+
+		# YOLO encoder
+		self.encoder = gdet.create_box_encoder(model_filename, batch_size=encoder_batch_size)
+
+		# initialize deep sort
+		if self.is_tracked:
+			# calculate cosine distance metric
+			metric = nn_matching.NearestNeighborDistanceMetric("cosine", max_cosine_distance, nn_budget)
+			# initialize tracker
+			self.tracker = Tracker(metric, n_init=3)
+		else:
+			self.tracker = None
+
+	def update(self, t, frame, detections):
+		bboxes, scores, classes = detections
+
+		if self.debug:
+			print("[xx]", [bboxes, scores, classes, len(bboxes)])
+
+		if self.class_names is None:
+			# Give class names
+			names = ["class_%d" % i for i in classes]
+			eprint("[xx]", classes)
+
+		else:
+			# custom allowed classes (uncomment line below to customize tracker for only people)
+			allowed_classes = self.class_names
+
+			# loop through objects and use class index to get class name, allow only classes in allowed_classes list
+			names = []
+			deleted_indx = []
+			for i, idx in enumerate(classes):
+				if int(idx) < len(allowed_classes):
+					names.append(allowed_classes[int(idx)])
+				else:
+					deleted_indx.append(i)
+
+			names = np.array(names)
+
+			# delete detections that are not in allowed_classes
+			bboxes = np.delete(bboxes, deleted_indx, axis=0)
+			scores = np.delete(scores, deleted_indx, axis=0)
+
+		# encode yolo detections and feed to tracker
+		features = self.encoder(frame, bboxes)
+		detections = [self.Detection(bbox, score, class_name, feature) for bbox, score, class_name, feature in
+					  zip(bboxes, scores, names, features)]
+
+		# run non-maxima supression
+		boxs = np.array([d.tlwh for d in detections])
+		scores = np.array([d.confidence for d in detections])
+		classes = np.array([d.class_name for d in detections])
+
+		indices = self.preprocessing.non_max_suppression(boxs, classes, self.nms_max_overlap, scores)
+		detections = [detections[i] for i in indices]
+
+		# Call the tracker
+		if self.is_tracked:
+			self.tracker.predict()
+			self.tracker.update(detections)
+
+			detections = self.tracker.tracks
+
+		person_t = []
+
+		# update tracks
+		for track in detections:
+			bbox = track.to_tlbr()
+
+			if self.is_tracked and (not track.is_confirmed() or track.time_since_update > 1):
+				if not track.is_confirmed():
+					person_t.append({"x1": bbox[0], "y1": bbox[1], "x2": bbox[2], "y2": bbox[3], "id": -1})
+				continue
+
+			id = track.track_id if self.is_tracked else -1
+			person_t.append({"x1": bbox[0], "y1": bbox[1], "x2": bbox[2], "y2": bbox[3], "id": id, "name": track.get_class()})
+
+		return person_t
+
+
+class SyntheticCrowd:
+	"""
+	Deterministic crowd walking around a width x height frame, with handshakes between neighbours (about handshake_rate
+	new ones per frame). People stop and step towards each other while they shake hands.
+	Ground truth of the synthetic backends : boxes with the ids of a perfect tracker (people and handshakes from 1)
+	"""
+
+	def __init__(self, n_people=20, width=1920, height=1080, speed=4., handshake_rate=.02, handshake_frames=30,
+				 dropout=.05, seed=0, history=256):
+		"""
+		:param speed: pixels per frame
+		:param dropout: probability that a person is not detected in a frame
+		:param history: frames kept after they are simulated (earlier frames are simulated again from the start)
+		"""
+		self.n_people = n_people
+		self.width = width
+		self.height = height
+		self.speed = speed
+		self.handshake_rate = handshake_rate
+		self.handshake_frames = handshake_frames
+		self.dropout = dropout
+		self.seed = seed
+		self.history = history
+
+		self.reset()
+
+	def reset(self):
+		n = self.n_people
+		self.rng = rng = np.random.default_rng(self.seed)
+
+		w = rng.uniform(40, 80, n)
+		self.size = np.stack([w, 2.5 * w], axis=1)
+		self.pos = rng.uniform(self.size / 2, [self.width, self.height] - self.size / 2)		# box centres
+		angle = rng.uniform(0, 2 * np.pi, n)
+		self.vel = self.speed * np.stack([np.cos(angle), np.sin(angle)], axis=1)
+
+		self.partner = np.full(n, -1)
+		self.shakes = []		# [id, p1, p2, frames left]
+		self.n_shakes = 0
+		self.t = -1
+		self.frames = OrderedDict()		# t : (people, handshakes) of the last frames
+
+		self.step()
+
+	def step(self):
+		rng = self.rng
+
+		# Handshakes that are over
+		for hs in self.shakes:
+			hs[3] -= 1
+			if hs[3] <= 0: self.partner[hs[1]] = self.partner[hs[2]] = -1
+		self.shakes = [hs for hs in self.shakes if hs[3] > 0]
+
+		# Walk (random turns, bounce off the edges)
+		moving = self.partner < 0
+		self.vel[moving] += rng.normal(0, .2 * self.speed, (np.count_nonzero(moving), 2))
+		self.vel *= np.minimum(1, self.speed / np.maximum(np.linalg.norm(self.vel, axis=1, keepdims=True), 1e-9))
+		self.pos[moving] += self.vel[moving]
+
+		lo, hi = self.size / 2, [self.width, self.height] - self.size / 2
+		out = (self.pos < lo) | (self.pos > hi)
+		self.vel[out] *= -1
+		self.pos = np.clip(self.pos, lo, hi)
+
+		# Partners step towards each other
+		for _, p1, p2, _ in self.shakes:
+			d = self.pos[p2] - self.pos[p1]
+			gap = np.linalg.norm(d) - (self.size[p1, 0] + self.size[p2, 0]) / 2
+			if gap > 0:
+				move = d / np.linalg.norm(d) * min(self.speed, gap / 2)
+				self.pos[p1] += move
+				self.pos[p2] -= move
+
+		# New handshakes, with the nearest free person
+		for _ in range(rng.poisson(self.handshake_rate)):
+			free = np.nonzero(self.partner < 0)[0]
+			if len(free) < 2: break
+
+			p1 = rng.choice(free)
+			others = free[free != p1]
+			p2 = others[np.argmin(np.linalg.norm(self.pos[others] - self.pos[p1], axis=1))]
+
+			self.n_shakes += 1
+			self.shakes.append([self.n_shakes, p1, p2, self.handshake_frames])
+			self.partner[p1], self.partner[p2] = p2, p1
+
+		detected = np.nonzero(rng.random(self.n_people) >= self.dropout)[0]
+		self.t += 1
+
+		# People (detected) and handshakes (between the partners, at hand height) as (x1, y1, x2, y2, id)
+		people = np.column_stack([self.pos[detected] - self.size[detected] / 2, self.pos[detected] + self.size[detected] / 2, detected + 1])
+
+		handshakes = []
+		for hs_id, p1, p2, _ in self.shakes:
+			(cx1, cy1), (cx2, cy2) = self.pos[p1], self.pos[p2]
+			w, h = (self.size[p1] + self.size[p2]) / 2
+			handshakes.append([min(cx1, cx2) - w / 4, (cy1 + cy2) / 2 - h / 8, max(cx1, cx2) + w / 4, (cy1 + cy2) / 2 + h / 8, hs_id])
+
+		self.frames[self.t] = (people, np.array(handshakes).reshape((-1, 5)))
+		if len(self.frames) > self.history: self.frames.popitem(last=False)
+
+	def get_frame(self, t):
+		if t not in self.frames:
+			if t < self.t: self.reset()
+			while self.t < t: self.step()
+		return self.frames[t]
+
+	@staticmethod
+	def to_dicts(boxes):
+		return [{"x1": x1, "y1": y1, "x2": x2, "y2": y2, "id": int(i)} for x1, y1, x2, y2, i in boxes.tolist()]
+
+	def people(self, t):
+		""" Detections of frame t : [{"x1", "y1", "x2", "y2", "id"}] """
+		return self.to_dicts(self.get_frame(t)[0])
+
+	def handshakes(self, t):
+		""" Handshake boxes of frame t : [{"x1", "y1", "x2", "y2", "id"}] """
+		return self.to_dicts(self.get_frame(t)[1])
+
+
+class SyntheticDetector(DetectorBackend):
+	""" The boxes of a SyntheticCrowd ("person" or "handshake") """
+
+	def __init__(self, crowd, kind="person"):
+		self.crowd = crowd
+		self.get = crowd.people if kind == "person" else crowd.handshakes
+
+	def detect(self, frames, frame_indices):
+		out = []
+		for t in frame_indices:
+			dets = self.get(t)
+			bboxes = np.array([[d["x1"], d["y1"], d["x2"] - d["x1"], d["y2"] - d["y1"]] for d in dets], dtype=np.float32).reshape((-1, 4))
+			out.append((bboxes, np.ones(len(dets), dtype=np.float32), np.zeros(len(dets), dtype=np.float32)))
+		return out
+
+
+class SyntheticTracker(TrackerBackend):
+	""" Perfect tracker of a SyntheticCrowd : its boxes and ids ("person" or "handshake") """
+
+	def __init__(self, crowd, kind="person", is_tracked=True, class_name=None):
+		self.get = crowd.people if kind == "person" else crowd.handshakes
+		self.is_tracked = is_tracked
+		self.class_name = kind if class_name is None else class_name
+
+	def update(self, t, frame, detections):
+		return [dict(d, id=d["id"] if self.is_tracked else -1, name=self.class_name) for d in self.get(t)]
+
+
+class SyntheticVideo:
+	""" Stand in for NNHandler_image in create_yolo : blank frames (the synthetic backends do not look at them) """
+
+	def __init__(self, frames, width=1920, height=1080):
+		self.time_series_length = frames
+		self.width = width
+		self.height = height
+		self.frame = None
+
+	def open(self, start_frame=None, init_param=False):
+		pass
+
+	def close(self):
+		pass
+
+	def prefetch(self, start_frame=None, end_frame=None, **kwargs):
+		if self.frame is None: self.frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+		if start_frame is None: start_frame = 0
+		if end_frame is None: end_frame = self.time_series_length
+
+		for t in range(start_frame, end_frame):
+			yield t, self.frame
@@ -3,31 +3,162 @@ import cv2
 import numpy as np
 from collections import defaultdict
 
-from Node_Person import Person
+from Node_Person import Person, HandshakeSeries
+from SparsePairTensor import SparsePairTensor
+from SpatialGrid import near_pairs, expand_ranges
+from ChunkPool import map_chunks
 from suren.util import eprint, stop, progress, Json
 # from sklearn.cluster import SpectralClustering
 
-try:
-	# import networkx as nx
-	import matplotlib.pyplot as plt
-	import matplotlib.cm as cm
-	from mpl_toolkits.axes_grid1 import make_axes_locatable
+# Graph visualization packages : loaded by Graph.plot_import (only the plotting methods need them, and matplotlib
+# is slow to import)
+plt, cm, make_axes_locatable = None, None, None
 
 
-	
+# SHOW = False  # No idea if this would work when importing @all...maybe call as function?
 
-except ImportError as e:
-	eprint(e)
 
+# Chunk kernels of the VECTORIZED analysis : func(arrays, c1, c2, params) for frames [c1, c2)
+# They are module level so that ChunkPool worker processes can run them
 
-# SHOW = False  # No idea if this would work when importing @all...maybe call as function?
+def pairwise_distance(XY):
+	""" N x T x 2 positions -> N x N x T distance of every pair """
+	return np.sqrt(np.sum(np.power(XY[:, None, :, :] - XY[None, :, :, :], 2), axis=-1))
+
+
+def near_codetected_pairs(XY, t1, t2, c1, c2, radius):
+	"""
+	Pairs closer than radius in frames [c1, c2) that are co-detected (t1 <= t < t2), found with a uniform grid
+	:return: t, p1, p2, dist sorted by (t, p1, p2)
+	"""
+	# A pair can only be co-detected after both nodes are first detected (window of a node with itself)
+	start = np.diagonal(t1)
+	detected = np.diagonal(t2) > start
+	valid = detected[:, None] & (np.arange(c1, c2) >= start[:, None])
+
+	t, p1, p2, dist = near_pairs(XY[:, c1:c2], valid, radius)
+	t += c1
+
+	keep = (t1[p1, p2] <= t) & (t < t2[p1, p2])
+	return t[keep], p1[keep], p2[keep], dist[keep]
+
+
+def cluster_chunk(arrays, c1, c2, params):
+	""" findClusters (VECTORIZED) : pairDetectionProbability and groupProbability of the chunk (N x N x (c2-c1)) """
+	t1, t2 = arrays["t1"], arrays["t2"]
+	t = np.arange(c1, c2)
+
+	pdp = (t1[:, :, None] <= t) & (t < t2[:, :, None])
+	gp = pairwise_distance(arrays["floor"][:, c1:c2]) < params["group_dist"]
+	return pdp, gp
+
+
+def cluster_chunk_sparse(arrays, c1, c2, params):
+	""" findClusters (SPARSE_PAIRS) : sum(group * pairDetection), sum(pairDetection) over the chunk """
+	t1, t2 = arrays["t1"], arrays["t2"]
+
+	if params["cutoff"] is None:
+		pdp, gp = cluster_chunk(arrays, c1, c2, params)
+		return np.sum(gp & pdp, -1, dtype=np.float32), np.sum(pdp, -1, dtype=np.float32)
+
+	# Only the pairs closer than GROUP_DIST_THRESH are visited (grid search). sum(pairDetection) is t2 - t1
+	N = len(t1)
+	_, p1, p2, _ = near_codetected_pairs(arrays["floor"], t1, t2, c1, c2, params["group_dist"])
+	return np.bincount(p1 * N + p2, minlength=N * N), None
+
+
+def threat_chunk(arrays, c1, c2, params):
+	""" calculateThreatLevel (VECTORIZED) : pairD, pairI, pairM, pairG, pairT and frameThreatLevel of the chunk """
+	g = arrays["g"]
+	P = len(g)
+
+	EPS_m = 2.0
+	EPS_g = 2.0
+
+	notSelf = ~np.eye(P, dtype=bool)
+	pdp = arrays["pdp"][:, :, c1:c2].transpose((2, 0, 1)) * notSelf
+	d = np.exp(-1.0*pairwise_distance(arrays["floor"][:, c1:c2]).transpose((2, 0, 1))/params["tau"])
+	i = arrays["partners"][:, c1:c2].T[:, :, None] == np.arange(P)
+	m = np.zeros_like(d)		# get from graph self.nodes @Suren
+
+	threatOfPair = ((d+i)*(EPS_m-m)).astype(np.float64)*(EPS_g-g)*pdp
+	# cumsum keeps the (p1, p2) accumulation order of NAIVE, so the float32 result is identical
+	frameThreatLevel = np.cumsum(threatOfPair.reshape((c2-c1, -1)), axis=1)[:, -1]
+
+	out = [d*pdp, i*pdp, m*pdp, g*pdp, threatOfPair, frameThreatLevel]
+	return [a.astype(np.float32) for a in out]
+
+
+def threat_chunk_sparse(arrays, c1, c2, params):
+	""" calculateThreatLevelSparse : (t, p1, p2, D, I, M, G, T) entries and frameThreatLevel of the chunk """
+	t1, t2 = arrays["t1"], arrays["t2"]
+	k1, k2 = arrays["k1"], arrays["k2"]
+	XY = arrays["floor"]
+	partners = arrays["partners"]
+	P = len(t1)
+
+	EPS_m = 2.0
+	EPS_g = 2.0
 
+	if params["cutoff"] is None:
+		# (t, p1, p2) of every co-detected pair in this chunk, sorted by frame
+		kt1, kt2 = t1[k1, k2], t2[k1, k2]
+		sel = np.nonzero((kt1 < c2) & (kt2 > c1))[0]
+		s = np.maximum(kt1[sel], c1)
+		n = np.minimum(kt2[sel], c2) - s
+		t = expand_ranges(s, n)
+		pair = np.repeat(sel, n)
+
+		order = np.argsort(t, kind="stable")
+		t, p1, p2 = t[order], k1[pair[order]], k2[pair[order]]
+
+	else:
+		# Only the co-detected pairs closer than NEIGHBOR_CUTOFF, and the ones shaking hands however far apart
+		t, p1, p2, _ = near_codetected_pairs(XY, t1, t2, c1, c2, params["cutoff"])
+
+		hn, ht = np.nonzero(partners[:, c1:c2] >= 0)
+		ht += c1
+		hp = partners[hn, ht]
+		hs = (t1[hn, hp] <= ht) & (ht < t2[hn, hp]) & (hn != hp)
+
+		# The near pairs are sorted by (t, p1, p2) : only the few handshakes not among them are merged in
+		key = (t*P + p1)*P + p2
+		hkey = np.unique(((ht*P + hn)*P + hp)[hs])
+		pos = np.searchsorted(key, hkey)
+		hkey = hkey[(pos == len(key)) | (key[np.minimum(pos, len(key) - 1)] != hkey)] if len(key) else hkey
+		if len(hkey) > 0:
+			key = np.sort(np.concatenate([key, hkey]))
+			t, p1, p2 = key // (P*P), key // P % P, key % P
+
+	dist = np.sqrt(np.sum(np.power(XY[p1, t, :] - XY[p2, t, :], 2), axis=-1))
+	d = np.exp(-1.0*dist/params["tau"])
+	i = partners[p1, t] == p2
+	m = np.zeros_like(d)		# get from graph self.nodes @Suren
+	g = arrays["g"][p1, p2]
+
+	threatOfPair = ((d+i)*(EPS_m-m)).astype(np.float64)*(EPS_g-g)
+
+	# Frame sums in the same order as the dense loop (row of zero padded pairs per frame)
+	counts = np.bincount(t - c1, minlength=c2 - c1)
+	rank = np.arange(len(t)) - np.repeat(np.cumsum(counts) - counts, counts)
+	frameT = np.zeros((c2 - c1, max(1, np.max(counts))), dtype=np.float64)
+	frameT[t - c1, rank] = threatOfPair
+	frameThreatLevel = np.cumsum(frameT, axis=1)[:, -1]
+
+	return [t, p1, p2, d, i, m, g, threatOfPair], frameThreatLevel
 
-# Graph visualization packages
 
 class Graph:
+	# Time series of Person nodes stored as N x T arrays in columnar mode (+ "handshake", see HandshakeSeries).
+	# Coordinates are float64 like the lists, so that saved graphs and json <-> binary conversions are lossless
+	COLUMNS = {"xMin": np.float64, "xMax": np.float64, "yMin": np.float64, "yMax": np.float64, "detection": bool,
+			   "interpolated": bool, "X": np.float64, "Y": np.float64, "X_project": np.float64, "Y_project": np.float64}
+
+	BINARY_FORMAT = 1		# version of the saveToBinary layout
+
 	@staticmethod
 	def plot_import():
+		global plt, cm, make_axes_locatable
 		try:
 			# import networkx
 			import matplotlib.pyplot as plt
@@ -39,9 +170,10 @@ class Graph:
 			# SHOW = False  # No idea if this would work when importing @all...maybe call as function?
 			return e
 
-	def __init__(self, time_series_length=None, save_name=None):
+	def __init__(self, time_series_length=None, save_name=None, columnar=False):
 		"""
 		:param timeSeriesLength: Number of frames
+		:param columnar: Graph owns the node time series as N x T arrays (node params are views into them)
 		"""
 		self.time_series_length = time_series_length
 		# self.time_series_length = 10
@@ -53,6 +185,9 @@ class Graph:
 		self.n_person = 0
 		self.nodes = []			# arr with n_nodes number of Person Objects
 
+		self.columnar = columnar
+		self.columns = None		# dict of N x T arrays (columnar mode). Rows >= n_nodes are spare capacity
+
 		self.state = {
 			"people" : 0, 		# 1 - people bbox, 2 - tracking id
 			"handshake" : 0, 	# 1 - hs only, 2 - with tracking id, 3 - person info
@@ -65,6 +200,7 @@ class Graph:
 		self.saveGraphFileName = save_name
 
 		self.BIG_BANG = 0  # HUH -_-
+		self.start_time = 0		# frame of the source (video / stored graph) that is frame 0 of this graph
 		self.threatLevel = None
 
 		self.PROJECTED_SPACE_H=1000
@@ -81,6 +217,12 @@ class Graph:
 		self.pairT = None
 		self.frameThreatLevel = None
 
+		self.CHUNK_SIZE = 256		# frames per batch in the vectorized pair computations
+		self.SPARSE_PAIRS = False	# store pair tensors only for co-detected pairs (SparsePairTensor). Vectorized, whatever METHOD
+		self.pairDetectionWindow = None
+		self.NEIGHBOR_CUTOFF = None	# (sparse pairs) only pairs closer than this on the floor map, or shaking hands, get a threat
+		self.N_WORKERS = 1			# processes sharing the chunks of the VECTORIZED analysis, None for all cores (see ChunkPool)
+
 	def __repr__(self):
 		rep = "Created Graph object with nodes = %d for frames = %d. Param example:\n" % (
 		self.n_nodes, self.time_series_length)
@@ -291,6 +433,7 @@ class Graph:
 
 	def get_cmap(self, n : int = None, show=False):
 		if n is None: n = self.n_nodes
+		Graph.plot_import()
 
 		colors = cm.hsv(np.linspace(0, .8, n))
 		window = 10
@@ -374,8 +517,71 @@ class Graph:
 		self.n_person += 1
 		self.n_nodes = len(self.nodes)
 
+		if self.columnar: self.bind_node(p, self.n_nodes - 1)
+
 		return p
 
+	def alloc_columns(self, capacity):
+		"""
+		(Re)allocate the columns with room for capacity nodes. Existing rows are copied and node views rebound.
+		"""
+		T = self.time_series_length
+		assert T is not None, "Number of frames must be known to store nodes as columns"
+
+		columns = {par: np.zeros((capacity, T), dtype=dtype) for par, dtype in Graph.COLUMNS.items()}
+		handshake = {key: np.full((capacity, T), none, dtype=dtype) for key, (dtype, none) in HandshakeSeries.FIELDS.items()}
+
+		if self.columns is None:
+			self.columns = columns
+			self.columns["handshake"] = handshake
+			return
+
+		# Update in place. Nodes keep a reference to self.columns
+		n = min(capacity, len(self.columns["detection"]))
+		for par in columns:
+			columns[par][:n] = self.columns[par][:n]
+		for key in handshake:
+			handshake[key][:n] = self.columns["handshake"][key][:n]
+
+		self.columns.update(columns)
+		self.columns["handshake"] = handshake
+
+		for node in self.nodes:
+			if node.columns is None: continue
+			for par in Graph.COLUMNS:
+				if par in node.params: node.params[par] = node.columnView(par)
+
+	def bind_node(self, p, row):
+		"""
+		Move the time series of node p into row of the columns. p.params then holds views.
+		"""
+		if p.columns is not None and p.columns[0] is self.columns and p.columns[1] == row:
+			return		# Created on this row (Person(columns=...)), already holds views
+
+		if self.columns is None or len(self.columns["detection"]) <= row:
+			self.alloc_columns(max(16, 2 * (row + 1)))
+
+		p.columns = (self.columns, row)
+		for par in list(p.params):
+			if p.isColumn(par):
+				p.setSeries(par, p.params.pop(par))
+
+	def make_columnar(self):
+		"""
+		Switch an existing graph to columnar storage
+		"""
+		self.columnar = True
+		if self.n_nodes > 0: self.alloc_columns(self.n_nodes)
+		for n, p in enumerate(self.nodes):
+			self.bind_node(p, n)
+
+	def get_column(self, par):
+		"""
+		:return: N x T array of param par (columnar mode)
+		"""
+		assert self.columnar, "Graph is not columnar"
+		return self.columns[par][:self.n_nodes]
+
 	# def addNode(self,time):
 	# 	print("GRAPH: adding (person) node")
 	# 	self.nodes.append(Person())
@@ -405,16 +611,157 @@ class Graph:
 			"N": self.n_nodes,
 			"frames": self.time_series_length,
 			"state": self.state,
-			"nodes": [n.params for n in self.nodes]
+			"start_time": self.start_time,
+			"nodes": [{par: (val.tolist() if hasattr(val, "tolist") else val) for par, val in n.params.items()} for n in self.nodes]
 		}
 
-		Json.is_jsonable(data)  # Delete this later @suren
-
 		js = Json(file_name)
 		js.write(data)
 
 		print("Finished writing all nodes to {}".format(file_name))
 
+	def get_series(self, par, frames=None):
+		"""
+		:param frames: Only these frames (default all)
+		:return: N x T (N x len(frames)) array of time series par (from the columns, or stacked from the node params)
+		"""
+		if self.columnar:
+			return self.get_column(par) if frames is None else self.get_column(par)[:, frames]
+
+		if frames is not None: frames = np.asarray(frames).tolist()
+
+		out = np.zeros((self.n_nodes, self.time_series_length if frames is None else len(frames)), dtype=Graph.COLUMNS[par])
+		for row, n in zip(out, self.nodes):
+			row[:] = n.params[par] if frames is None else list(map(n.params[par].__getitem__, frames))
+		return out
+
+	def get_handshake_series(self, key):
+		"""
+		:return: N x T array of field key of the handshake dicts (None stored as in HandshakeSeries.FIELDS)
+		"""
+		if self.columnar:
+			return self.columns["handshake"][key][:self.n_nodes]
+
+		dtype, none = HandshakeSeries.FIELDS[key]
+		out = np.full((self.n_nodes, self.time_series_length), none, dtype=dtype)
+		for n, node in enumerate(self.nodes):
+			for t, hs in enumerate(node.params["handshake"]):
+				if hs.get(key) is not None: out[n, t] = hs[key]
+		return out
+
+	def saveToBinary(self, dir_name):
+		"""
+		Binary graph : dir_name/graph.json (state, N, frames, static node params) + one N x T .npy file per time series.
+		Load with init_from_binary (memory mapped). See also json_to_binary / binary_to_json.
+		"""
+		if not os.path.exists(dir_name): os.makedirs(dir_name)
+
+		series = [par for par in Graph.COLUMNS if all(par in n.params for n in self.nodes)]
+		handshake = self.n_nodes > 0 and all("handshake" in n.params for n in self.nodes)
+
+		for par in series:
+			np.save(os.path.join(dir_name, par + ".npy"), self.get_series(par))
+		if handshake:
+			for key in HandshakeSeries.FIELDS:
+				np.save(os.path.join(dir_name, "handshake_" + key + ".npy"), self.get_handshake_series(key))
+
+		static = [{par: (val.item() if hasattr(val, "item") else val) for par, val in n.params.items()
+				   if par not in Graph.COLUMNS and par != "handshake"} for n in self.nodes]
+
+		header = {
+			"format": Graph.BINARY_FORMAT,
+			"N": self.n_nodes,
+			"frames": self.time_series_length,
+			"state": self.state,
+			"start_time": self.start_time,
+			"series": series,
+			"handshake": handshake,
+			"nodes": static
+		}
+		with open(os.path.join(dir_name, "graph.json"), 'w') as f:
+			json.dump(header, f)
+
+		print("Finished writing all nodes to {}".format(dir_name))
+
+	def init_from_binary(self, dir_name, mmap_mode='r', start_time=None, end_time=None):
+		"""
+		Open a graph written by saveToBinary. The graph becomes columnar and its columns are memory mapped,
+		so only the frames that are used are read from disk.
+		:param mmap_mode: 'r' (read only), 'c' (copy on write, for graphs that will be modified) or None (load)
+		:param start_time, end_time: Only open frames [start_time, end_time) (see init_from_json)
+		"""
+		assert self.n_nodes == 0, "Graph not empty. Cannot load into non-empty graph"
+
+		with open(os.path.join(dir_name, "graph.json")) as f:
+			header = json.load(f)
+
+		N = header["N"]
+		if N == 0:
+			eprint("No nodes :(")
+			return
+
+		self.state = header["state"]
+		self.start_time = header.get("start_time", 0)
+		self.columnar = True
+
+		def load(name):
+			return np.load(os.path.join(dir_name, name + ".npy"), mmap_mode=mmap_mode)
+
+		windowed = start_time is not None or end_time is not None
+		if windowed:
+			t0, t1 = self.get_window(header["frames"], start_time, end_time, self.start_time)
+
+			# Only the rows of nodes detected in the window, and only the window of each row, are read
+			keep = np.nonzero(np.any(load("detection")[:, t0:t1], axis=1))[0]
+			load_window = lambda name: np.array(load(name)[keep, t0:t1])
+			static = [Graph.clip_detection_window(header["nodes"][k], t0, t1) for k in keep]
+
+			N = len(keep)
+			self.start_time += t0
+			self.time_series_length = t1 - t0
+		else:
+			load_window = load
+			static = header["nodes"]
+			self.time_series_length = header["frames"]
+
+		# Missing series are zeros (np.zeros pages are only allocated when written)
+		self.columns = {par: (load_window(par) if par in header["series"] else np.zeros((N, self.time_series_length), dtype=dtype))
+						for par, dtype in Graph.COLUMNS.items()}
+		if header["handshake"]:
+			self.columns["handshake"] = {key: load_window("handshake_" + key) for key in HandshakeSeries.FIELDS}
+			if windowed:
+				# Partners are node indices. Renumber them to the kept nodes (-1 if the partner was dropped)
+				new_ind = np.full(header["N"], -1, dtype=np.int64)
+				new_ind[keep] = np.arange(N)
+				person = self.columns["handshake"]["person"]
+				person[:] = np.where(person >= 0, new_ind[person], -1)
+		else:
+			self.columns["handshake"] = {key: np.full((N, self.time_series_length), none, dtype=dtype)
+										 for key, (dtype, none) in HandshakeSeries.FIELDS.items()}
+
+		stored = header["series"] + (["handshake"] if header["handshake"] else [])
+		for n in range(N):
+			p = Person(time_series_length=self.time_series_length, idx=n, columns=(self.columns, n))
+			p.params.update(static[n])
+			for par in stored:
+				p.params[par] = p.columnView(par)
+
+			self.nodes.append(p)
+			self.n_person += 1
+		self.n_nodes = len(self.nodes)
+
+	@staticmethod
+	def json_to_binary(json_file, dir_name):
+		g = Graph()
+		g.init_from_json(json_file)
+		g.saveToBinary(dir_name)
+
+	@staticmethod
+	def binary_to_json(dir_name, json_file):
+		g = Graph()
+		g.init_from_binary(dir_name)
+		g.saveToFile(json_file)
+
 	def getCameraInfoFromJson(self,fileName):
 		with open(fileName) as json_file:
 			data = json.load(json_file)
@@ -431,7 +778,32 @@ class Graph:
 		self.DISTANCE_TAU = data["distance_tau"]
 
 
-	def init_from_json(self, file_name):
+	@staticmethod
+	def get_window(time_series_length, start_time=None, end_time=None, offset=0):
+		"""
+		:return: [t0, t1) : frames [start_time, end_time) of the source as indices of a stored graph whose frame 0 is offset
+		"""
+		t0 = 0 if start_time is None else max(0, start_time - offset)
+		t1 = time_series_length if end_time is None else min(end_time - offset, time_series_length)
+		assert t0 < t1, "Empty frame window [%d, %d)" % (t0, t1)
+		return t0, t1
+
+	@staticmethod
+	def clip_detection_window(static, t0, t1):
+		"""
+		Static params of a node when only frames [t0, t1) are kept
+		"""
+		static = dict(static)
+		if "detectionStartT" in static and not static.get("neverDetected", False):
+			static["detectionStartT"] = min(max(static["detectionStartT"] - t0, 0), t1 - t0)
+			static["detectionEndTExclusive"] = min(max(static["detectionEndTExclusive"] - t0, 0), t1 - t0)
+		return static
+
+	def init_from_json(self, file_name, start_time=None, end_time=None):
+		"""
+		:param start_time, end_time: Only keep frames [start_time, end_time) of the source video. Frame t of the
+			graph is then frame start_time + t and nodes that are not detected in the window are dropped.
+		"""
 		with open(file_name) as json_file:
 			data = json.load(json_file)
 
@@ -454,13 +826,36 @@ class Graph:
 			time_series_length = len(data["nodes"][0]["detection"])
 
 		self.state = data["state"]
+		self.start_time = data.get("start_time", 0)
+
+
+		if start_time is not None or end_time is not None:
+			t0, t1 = self.get_window(time_series_length, start_time, end_time, self.start_time)
 
+			keep = [n for n in range(N) if any(data["nodes"][n]["detection"][t0:t1])]
+			new_ind = {n: i for i, n in enumerate(keep)}
+
+			nodes = []
+			for n in keep:
+				node = Graph.clip_detection_window(data["nodes"][n], t0, t1)
+				for par in node:
+					if par in Graph.COLUMNS:
+						node[par] = node[par][t0:t1]
+				if "handshake" in node:
+					# Partners are node indices. Renumber them to the kept nodes
+					node["handshake"] = [dict(hs, person=new_ind.get(hs["person"])) for hs in node["handshake"][t0:t1]]
+				nodes.append(node)
+
+			data["nodes"] = nodes
+			N = len(nodes)
+			self.start_time += t0
+			time_series_length = self.time_series_length = t1 - t0
 
 		if self.time_series_length is None: self.time_series_length = time_series_length
 
 		for n in range(N):
-			p = self.add_person()
-			p.setParamsFromDict(data["nodes"][n])
+			p = Person(time_series_length=self.time_series_length, initParams=data["nodes"][n])
+			self.add_person(p)
 
 	# def calculate_standing_locations(self):
 	# 	for n in self.nodes:
@@ -470,11 +865,68 @@ class Graph:
 	# 	for n in self.nodes:
 	# 		n.interpolate_undetected_timestamps()
 
-	def generateFloorMap(self, verbose=False, debug=False):
+	def calculate_floor_points(self):
+		"""
+		calculate_standing_locations, interpolate_undetected and project_standing_location of every node,
+		done for the whole graph at once on N x T arrays
+		:return: X_project, Y_project (N x T)
+		"""
+		detection = self.get_series("detection")
+		N, T = detection.shape
+
+		X = np.trunc((self.get_series("xMin") + self.get_series("xMax")) / 2)
+		Y = np.array(self.get_series("yMax"), dtype=np.float64)
+
+		# Previous and next detection of each frame. Gaps between them are linearly interpolated (as np.interp)
+		t = np.arange(T)
+		prevT = np.maximum.accumulate(np.where(detection, t, -1), axis=1)
+		nextT = np.minimum.accumulate(np.where(detection, t, T)[:, ::-1], axis=1)[:, ::-1]
+		interpolated = (prevT >= 0) & (nextT < T) & ~detection
+
+		n, t = np.nonzero(interpolated)
+		t0, t1 = prevT[n, t], nextT[n, t]
+		for val in [X, Y]:
+			slope = (val[n, t1] - val[n, t0]) / (t1 - t0)
+			val[n, t] = slope * (t - t0) + val[n, t0]
+
+		projected = np.dot(self.transMatrix, np.array([X.ravel(), Y.ravel(), np.ones(N * T)]))
+		X_project = (projected[0] / projected[2]).reshape((N, T))
+		Y_project = (projected[1] / projected[2]).reshape((N, T))
+
+		detected = np.any(detection, axis=1)
+		startT = np.argmax(detection, axis=1)
+		endT = T - np.argmax(detection[:, ::-1], axis=1)
+
+		series = {"X": X, "Y": Y, "interpolated": interpolated, "X_project": X_project, "Y_project": Y_project}
+		for n, node in enumerate(self.nodes):
+			node.params["neverDetected"] = not detected[n]
+			if detected[n]:
+				node.params["detectionStartT"] = int(startT[n])
+				node.params["detectionEndTExclusive"] = int(endT[n])
+
+			for par, val in series.items():
+				node.setSeries(par, val[n] if self.columnar else val[n].tolist())
+
+		return X_project, Y_project
+
+	@staticmethod
+	def check_method(METHOD, methods=("NAIVE", "VECTORIZED")):
+		if METHOD not in methods:
+			raise ValueError("Unknown method : %s (expected one of %s)" % (METHOD, ", ".join(methods)))
+
+	def generateFloorMap(self, METHOD="NAIVE", verbose=False, debug=False):
+		"""
+		:param METHOD: NAIVE (per node) or VECTORIZED (calculate_floor_points)
+		"""
+		Graph.check_method(METHOD)
 
 		assert self.state["people"] >= 2, "Floor map cannot be generated without people bbox"
 
-		if self.state["floor"] < 1:
+		floor = None
+		if self.state["floor"] < 1 and METHOD == "VECTORIZED":
+			floor = self.calculate_floor_points()
+
+		elif self.state["floor"] < 1:
 			for n in self.nodes:
 				n.calculate_standing_locations()
 			# self.state["floor"] = 1     # @suren : TODO
@@ -494,9 +946,18 @@ class Graph:
 		# Floor map N x T with X and Y points.
 		self.projectedFloorMapNTXY = np.zeros((self.n_nodes, self.time_series_length, 2),dtype=np.float32)
 
-		for n, node in enumerate(self.nodes):
-			self.projectedFloorMapNTXY[n, :, 0] = node.params["X_project"]
-			self.projectedFloorMapNTXY[n, :, 1] = node.params["Y_project"]
+		if floor is not None:
+			self.projectedFloorMapNTXY[:, :, 0] = floor[0]
+			self.projectedFloorMapNTXY[:, :, 1] = floor[1]
+
+		elif self.columnar:
+			self.projectedFloorMapNTXY[:, :, 0] = self.get_column("X_project")
+			self.projectedFloorMapNTXY[:, :, 1] = self.get_column("Y_project")
+
+		else:
+			for n, node in enumerate(self.nodes):
+				self.projectedFloorMapNTXY[n, :, 0] = node.params["X_project"]
+				self.projectedFloorMapNTXY[n, :, 1] = node.params["Y_project"]
 
 			# X = self.nodes[n].params["X"]
 			# Y = self.nodes[n].params["Y"]
@@ -517,51 +978,141 @@ class Graph:
 			print("Finished creating floormap {} ".format(self.projectedFloorMapNTXY.shape))
 
 
+	def pairwise_distance(self, t1=None, t2=None):
+		"""
+		Distance between every pair of nodes on the projected floor map
+		:param t1: First frame (default 0)
+		:param t2: Last frame, exclusive (default time_series_length)
+		:return: N x N x (t2-t1) array (float32)
+		"""
+		if t1 is None: t1 = 0
+		if t2 is None: t2 = self.time_series_length
+
+		return pairwise_distance(self.projectedFloorMapNTXY[:, t1:t2, :])
+
+	def get_pair_detection_window(self):
+		"""
+		Frames in which pairDetectionProbability is 1 for each pair (same window as findClusters)
+		:return: t1, t2 (N x N int arrays). Pair (p1, p2) is co-detected in frames t1 <= t < t2
+		"""
+		detected = np.array([not n.params["neverDetected"] for n in self.nodes], dtype=bool)
+		startT = np.array([n.params["detectionStartT"] if d else 0 for n, d in zip(self.nodes, detected)], dtype=int)
+		endT = np.array([n.params["detectionEndTExclusive"] if d else 0 for n, d in zip(self.nodes, detected)], dtype=int)
+
+		both = detected[:, None] & detected[None, :]
+		t1 = np.where(both, np.maximum(startT[:, None], startT[None, :]), 0)
+		t2 = np.where(both, np.maximum(endT[:, None], endT[None, :]), 0)
+		return t1, t2
+
+	def get_near_pairs(self, c1, c2, radius):
+		"""
+		Co-detected pairs closer than radius on the projected floor map, found with a uniform grid (see SpatialGrid)
+		:param c1: First frame
+		:param c2: Last frame, exclusive
+		:return: t, p1, p2, dist sorted by (t, p1, p2)
+		"""
+		t1, t2 = self.pairDetectionWindow
+		return near_codetected_pairs(self.projectedFloorMapNTXY, t1, t2, c1, c2, radius)
+
+	def map_chunks(self, func, arrays, params):
+		""" Run a chunk kernel over the timeline (in N_WORKERS processes) """
+		return map_chunks(func, arrays, params, self.time_series_length, self.CHUNK_SIZE, self.N_WORKERS)
+
 	def findClusters(self, METHOD="NAIVE", debug=False, verbose=False):
 
-		self.groupProbability = np.zeros((self.n_nodes, self.n_nodes, self.time_series_length), np.float32)
+		Graph.check_method(METHOD, ("NAIVE", "VECTORIZED", "SPECTRAL"))
+		assert self.NEIGHBOR_CUTOFF is None or self.SPARSE_PAIRS, "NEIGHBOR_CUTOFF needs SPARSE_PAIRS = True"
 
-		#There is a lot for me to do on this array.
-		self.pairDetectionProbability = np.zeros((self.n_nodes, self.n_nodes, self.time_series_length), np.float32)
+		if self.SPARSE_PAIRS:
+			# N x N x T tensors are never stored. Only the detection window of each pair is kept,
+			# and (b, c) below are accumulated chunk by chunk
+			# (the chunk kernels are vectorized : METHOD does not apply, so fullyAnalyzeGraph() works as is)
+
+			t1, t2 = self.get_pair_detection_window()
+			self.pairDetectionWindow = (t1, t2)
+			self.pairDetectionProbability = None
+
+			N = self.n_nodes
+			res = self.map_chunks(cluster_chunk_sparse, {"floor": self.projectedFloorMapNTXY, "t1": t1, "t2": t2},
+								  {"group_dist": self.GROUP_DIST_THRESH, "cutoff": self.NEIGHBOR_CUTOFF})
+
+			if self.NEIGHBOR_CUTOFF is None:
+				b = np.zeros((N, N), np.float32)
+				c = np.zeros((N, N), np.float32)
+				for _, _, (b_chunk, c_chunk) in res:
+					b += b_chunk
+					c += c_chunk
+
+			else:
+				# Same (b, c), but only the pairs closer than GROUP_DIST_THRESH were visited (grid search)
+				c = np.maximum(t2 - t1, 0).astype(np.float32)
+				b = np.zeros(N * N, np.float32)
+				for _, _, (b_chunk, _) in res:
+					b += b_chunk
+				b = b.reshape((N, N))
+				np.fill_diagonal(b, np.diagonal(c))		# distance 0 to itself
+
+		else:
+			self.groupProbability = np.zeros((self.n_nodes, self.n_nodes, self.time_series_length), np.float32)
+
+			#There is a lot for me to do on this array.
+			self.pairDetectionProbability = np.zeros((self.n_nodes, self.n_nodes, self.time_series_length), np.float32)
+
+			if METHOD=="NAIVE":
+				for p1 in range(self.n_nodes):
+					for p2 in range(self.n_nodes):
+						if p1<=p2:
+							if not self.nodes[p1].params["neverDetected"] and not self.nodes[p2].params["neverDetected"]:
+								t1=max(self.nodes[p1].params["detectionStartT"],self.nodes[p2].params["detectionStartT"])
+								t2=max(self.nodes[p1].params["detectionEndTExclusive"],self.nodes[p2].params["detectionEndTExclusive"])
+								self.pairDetectionProbability[p1,p2,t1:t2]=1.00
+
+
+							tempDistDeleteThisVariableLater=[]
+							for t in range(self.time_series_length):
+								dist=np.sqrt(np.sum(np.power(self.projectedFloorMapNTXY[p1,t,:]-self.projectedFloorMapNTXY[p2,t,:],2)))
+								tempDistDeleteThisVariableLater.append(dist)
+								if dist<self.GROUP_DIST_THRESH:
+									self.groupProbability[p1,p2,t]=1.0
+								else:
+									self.groupProbability[p1,p2,t]=0.0
+
+							if debug:
+								# print("Dist between {} and  {}:".format(p1,p2),tempDistDeleteThisVariableLater)
+								print("Dist between {} and  {}:".format(p1,p2),tempDistDeleteThisVariableLater[t1:t2])
+						else:
+							self.groupProbability[p1,p2,:]=self.groupProbability[p2,p1,:]
+							self.pairDetectionProbability[p1,p2,:]=self.pairDetectionProbability[p2,p1,:]
+
+
+
+
+			if METHOD=="VECTORIZED":
+				# Same result as NAIVE, but the N x N x T tensors are filled in batched numpy (chunks of frames)
+				t1, t2 = self.get_pair_detection_window()
+
+				res = self.map_chunks(cluster_chunk, {"floor": self.projectedFloorMapNTXY, "t1": t1, "t2": t2},
+									  {"group_dist": self.GROUP_DIST_THRESH})
+				for c1, c2, (pdp, gp) in res:
+					self.pairDetectionProbability[:, :, c1:c2] = pdp
+					self.groupProbability[:, :, c1:c2] = gp
+
+				if debug:
+					dist = self.pairwise_distance()
+					for p1 in range(self.n_nodes):
+						for p2 in range(p1, self.n_nodes):
+							print("Dist between {} and  {}:".format(p1,p2),dist[p1,p2,t1[p1,p2]:t2[p1,p2]])
+
+			if METHOD=="SPECTRAL":
+				print("THIS METHOD WAS REMOVED!!!")
+				""" <<<< end """
+
+
+			# (a,b,c) are temporary variables
+			a = self.groupProbability*self.pairDetectionProbability
+			b = np.sum(a,-1)
+			c = np.sum(self.pairDetectionProbability,-1)
 
-		if METHOD=="NAIVE":
-			for p1 in range(self.n_nodes):
-				for p2 in range(self.n_nodes):
-					if p1<=p2:
-						if not self.nodes[p1].params["neverDetected"] and not self.nodes[p2].params["neverDetected"]:
-							t1=max(self.nodes[p1].params["detectionStartT"],self.nodes[p2].params["detectionStartT"])
-							t2=max(self.nodes[p1].params["detectionEndTExclusive"],self.nodes[p2].params["detectionEndTExclusive"])
-							self.pairDetectionProbability[p1,p2,t1:t2]=1.00
-						
-
-						tempDistDeleteThisVariableLater=[]
-						for t in range(self.time_series_length):
-							dist=np.sqrt(np.sum(np.power(self.projectedFloorMapNTXY[p1,t,:]-self.projectedFloorMapNTXY[p2,t,:],2)))
-							tempDistDeleteThisVariableLater.append(dist)
-							if dist<self.GROUP_DIST_THRESH:
-								self.groupProbability[p1,p2,t]=1.0
-							else:
-								self.groupProbability[p1,p2,t]=0.0
-
-						if debug:
-							# print("Dist between {} and  {}:".format(p1,p2),tempDistDeleteThisVariableLater)
-							print("Dist between {} and  {}:".format(p1,p2),tempDistDeleteThisVariableLater[t1:t2])
-					else:
-						self.groupProbability[p1,p2,:]=self.groupProbability[p2,p1,:]
-						self.pairDetectionProbability[p1,p2,:]=self.pairDetectionProbability[p2,p1,:]
-
-
-
-
-		if METHOD=="SPECTRAL":
-			print("THIS METHOD WAS REMOVED!!!")
-			""" <<<< end """
-
-
-		# (a,b,c) are temporary variables
-		a = self.groupProbability*self.pairDetectionProbability
-		b = np.sum(a,-1)
-		c = np.sum(self.pairDetectionProbability,-1)
 		self.groupProbability = b/c
 
 		if verbose:
@@ -575,7 +1126,80 @@ class Graph:
 		# self.state["cluster"] = 1     # @suren : TODO
 
 
-	def calculateThreatLevel(self, debug=False):
+	def get_handshake_partners(self):
+		"""
+		Per frame handshake partner of each node
+		:return: N x T int array with the partner node index (-1 if no handshake)
+		"""
+		if self.columnar:
+			return self.columns["handshake"]["person"][:self.n_nodes].astype(int)
+
+		partners = np.full((self.n_nodes, self.time_series_length), -1, dtype=int)
+		for n, node in enumerate(self.nodes):
+			for t, hs in enumerate(node.params["handshake"]):
+				if hs["person"] is not None:
+					partners[n, t] = hs["person"]
+		return partners
+
+	def calculateThreatLevelSparse(self, debug=False):
+		"""
+		Same values as calculateThreatLevel, but pairD/pairI/pairM/pairG/pairT are SparsePairTensors
+		that only hold the co-detected pairs of each frame (see findClusters with SPARSE_PAIRS)
+		With NEIGHBOR_CUTOFF, pairs farther apart than the cutoff are dropped (unless shaking hands). Each dropped
+		pair would add at most 4 * exp(-NEIGHBOR_CUTOFF / DISTANCE_TAU) to the frame threat
+		"""
+		assert self.pairDetectionWindow is not None, "Run findClusters with SPARSE_PAIRS = True first"
+
+		P=len(self.nodes)
+		T=self.time_series_length
+
+		# Pairs that are co-detected in at least one frame (p1 major order, as in the dense loop)
+		t1, t2 = self.pairDetectionWindow
+		k1, k2 = np.nonzero((t1 < t2) & ~np.eye(P, dtype=bool))
+
+		arrays = {"floor": self.projectedFloorMapNTXY, "partners": self.get_handshake_partners(), "t1": t1, "t2": t2,
+				  "k1": k1, "k2": k2, "g": np.asarray(self.groupProbability, dtype=np.float32)}
+		res = self.map_chunks(threat_chunk_sparse, arrays, {"tau": self.DISTANCE_TAU, "cutoff": self.NEIGHBOR_CUTOFF})
+
+		entries = {"t": [], "p1": [], "p2": [], "D": [], "I": [], "M": [], "G": [], "T": []}
+		self.frameThreatLevel=np.zeros((T),dtype=np.float32)
+
+		for c1, c2, (chunk, frameThreatLevel) in res:
+			self.frameThreatLevel[c1:c2] = frameThreatLevel
+			for key, val in zip(entries, chunk):
+				entries[key].append(val)
+
+		if T == 0:
+			# Empty window : no chunks
+			for key in entries:
+				entries[key].append(np.zeros(0, dtype=np.int64 if key in ("t", "p1", "p2") else np.float32))
+
+		t = np.concatenate(entries["t"]).astype(np.int64)
+		offsets = np.zeros(T + 1, dtype=np.int64)
+		offsets[1:] = np.cumsum(np.bincount(t, minlength=T))
+		p1 = np.concatenate(entries["p1"]).astype(np.int32)
+		p2 = np.concatenate(entries["p2"]).astype(np.int32)
+
+		def pair_tensor(key):
+			return SparsePairTensor((T, P, P), offsets, p1, p2, np.concatenate(entries[key]).astype(np.float32))
+
+		self.pairD = pair_tensor("D")
+		self.pairI = pair_tensor("I")
+		self.pairM = pair_tensor("M")
+		self.pairG = pair_tensor("G")
+		self.pairT = pair_tensor("T")
+
+		if debug:
+			print("Co-detected pair entries : {} ({} dense)".format(len(p1), T*P*P))
+
+		print("Finished calculating threat level")
+
+	def calculateThreatLevel(self, METHOD="NAIVE", debug=False):
+		Graph.check_method(METHOD)
+		if self.SPARSE_PAIRS:
+			self.calculateThreatLevelSparse(debug=debug)
+			return
+
 		P=len(self.nodes)
 		T=self.time_series_length
 
@@ -587,43 +1211,59 @@ class Graph:
 		self.pairT=np.zeros((T,P,P),dtype=np.float32)
 		self.frameThreatLevel=np.zeros((T),dtype=np.float32)
 
-		for t in range(T):
-			threatLevel = 0.0
+		EPS_m = 2.0
+		EPS_g = 2.0
+
+		if METHOD=="NAIVE":
+			for t in range(T):
+				threatLevel = 0.0
+
+
+				for p1 in range(P):
+					interact = self.nodes[p1].params["handshake"][t]
+
+					for p2 in range(P):
+						if p1 != p2:
+							d=np.linalg.norm(self.projectedFloorMapNTXY[p1,t,:]-self.projectedFloorMapNTXY[p2,t,:])
+							d = np.exp(-1.0*d/self.DISTANCE_TAU)
+							i = 1 if interact["person"] == p2 else 0 #get from graph self.nodes @Jameel
+							m = 0.0 #get from graph self.nodes @Suren
+							g = self.groupProbability[p1,p2]
+
+							self.pairD[t,p1,p2]=d*self.pairDetectionProbability[p1,p2,t]
+							self.pairI[t,p1,p2]=i*self.pairDetectionProbability[p1,p2,t]
+							self.pairM[t,p1,p2]=m*self.pairDetectionProbability[p1,p2,t]
+							self.pairG[t,p1,p2]=g*self.pairDetectionProbability[p1,p2,t]
 
 
-			for p1 in range(P):
-				interact = self.nodes[p1].params["handshake"][t]
 
-				for p2 in range(P):
-					if p1 != p2:
-						d=np.linalg.norm(self.projectedFloorMapNTXY[p1,t,:]-self.projectedFloorMapNTXY[p2,t,:])
-						d = np.exp(-1.0*d/self.DISTANCE_TAU)
-						i = 1 if interact["person"] == p2 else 0 #get from graph self.nodes @Jameel
-						m = 0.0 #get from graph self.nodes @Suren
-						g = self.groupProbability[p1,p2]
-						
-						self.pairD[t,p1,p2]=d*self.pairDetectionProbability[p1,p2,t]
-						self.pairI[t,p1,p2]=i*self.pairDetectionProbability[p1,p2,t]
-						self.pairM[t,p1,p2]=m*self.pairDetectionProbability[p1,p2,t]
-						self.pairG[t,p1,p2]=g*self.pairDetectionProbability[p1,p2,t]
+							threatOfPair = (d+i)*(EPS_m-m)*(EPS_g-g)*self.pairDetectionProbability[p1,p2,t]
+							threatLevel += threatOfPair
 
+							self.pairT[t,p1,p2]=threatOfPair
+				self.frameThreatLevel[t]=threatLevel
 
+		elif METHOD=="VECTORIZED":
+			# Same as NAIVE, with (t, p1, p2) tensors built for a chunk of frames at a time
+			arrays = {"floor": self.projectedFloorMapNTXY, "pdp": self.pairDetectionProbability,
+					  "partners": self.get_handshake_partners(), "g": np.asarray(self.groupProbability, dtype=np.float32)}
 
-						EPS_m = 2.0
-						EPS_g = 2.0
-						threatOfPair = (d+i)*(EPS_m-m)*(EPS_g-g)*self.pairDetectionProbability[p1,p2,t]
-						threatLevel += threatOfPair
+			for c1, c2, (d, i, m, g, threatOfPair, frameThreatLevel) in self.map_chunks(threat_chunk, arrays, {"tau": self.DISTANCE_TAU}):
+				self.pairD[c1:c2] = d
+				self.pairI[c1:c2] = i
+				self.pairM[c1:c2] = m
+				self.pairG[c1:c2] = g
+				self.pairT[c1:c2] = threatOfPair
+				self.frameThreatLevel[c1:c2] = frameThreatLevel
 
-						self.pairT[t,p1,p2]=threatOfPair
-			self.frameThreatLevel[t]=threatLevel
 		print("Finished calculating threat level")
 
 		# self.state["threat"] = 1     # @suren : TODO
 
-	def fullyAnalyzeGraph(self):
+	def fullyAnalyzeGraph(self, METHOD="NAIVE"):
 		self.generateFloorMap()
-		self.findClusters()
-		self.calculateThreatLevel()
+		self.findClusters(METHOD=METHOD)
+		self.calculateThreatLevel(METHOD=METHOD)
 
 
 	def set_ax(self, ax, n):
@@ -636,7 +1276,8 @@ class Graph:
 		# ax.spines.right.set_visible(False)
 		# ax.spines.bottom.set_visible(False)
 		# ax.tick_params(bottom=False, labelbottom=False)
-		T_max = np.max(self.pairT, axis=None)
+		Graph.plot_import()
+		T_max = self.pairT.max()
 		im = ax.matshow(self.pairT[0, :, :], vmin=0, vmax=T_max)
 		divider = make_axes_locatable(ax)
 		cax = divider.append_axes('right', size='5%', pad=0.05)
@@ -645,7 +1286,7 @@ class Graph:
 		fig.savefig("./data/output/threat_image_init.jpg")
 
 	def threat_image_save(self, fig, ax, out_name, t):
-		T_max = np.max(self.pairT, axis=None)
+		T_max = self.pairT.max()
 		ax.matshow(self.pairT[t, :, :], vmin=0, vmax=T_max)
 		self.set_ax(ax, self.n_nodes)
 		# n, m = self.pairT[t, :, :].shape
@@ -655,6 +1296,7 @@ class Graph:
 		ax.clear()
 
 	def threat_image(self, fig, out_name, t):
+		Graph.plot_import()
 		fig.clf()
 		ax = fig.add_axes([0, 0, 1, 1])
 		im = ax.matshow(self.pairT[t, :, :])
@@ -680,6 +1322,7 @@ class Graph:
 			ax1.set_axis_off()
 
 	def dimg_init_concat(self, fig, ax):
+		Graph.plot_import()
 		vals = {
 			"d" : (self.pairD[0, :, :], "Distance"),
 			"i" : (self.pairI[0, :, :], "Interaction"),
@@ -707,6 +1350,7 @@ class Graph:
 		fig.savefig("./data/output/dimg_init_concat.png")
 
 	def dimg_init_full(self, fig, ax):
+		Graph.plot_import()
 		ax.clear()
 		# ax.spines.right.set_visible(False)
 		# ax.spines.top.set_visible(False)
@@ -1,3 +1,4 @@
+import threading
 import cv2 as cv
 
 class InputHandler:
@@ -7,51 +8,92 @@ class InputHandler:
 
 
 
-	def setInputFile(self,fileName):
+	def setInputFile(self,fileName,bufferSize=256):
+		"""
+		Frames of the video are decoded once and shared by all the connected components (NN handlers).
+		:param bufferSize: Frames held at most (ring buffer). A component that gets that far ahead of the slowest
+			one waits for it (back pressure)
+		"""
 		self.inputSet=True
 		self.videoIn=cv.VideoCapture(fileName)
-		self.bufferZerothFrame=-1
-		self.buffer=[]
+		self.bufferSize=bufferSize
+		self.buffer=[None]*bufferSize		# frame t is in buffer[t % bufferSize]
+		self.bufferZerothFrame=0			# oldest frame held
+		self.bufferEndFrame=0				# next frame to read
+		self.endOfInput=False
 		self.noConnectedComponents=0
 		self.connectedCoponentBlockSizes=[]
-		self.connectComponentNextFrame=[]
+		self.connectComponentNextFrame=[]	# None once disconnected
+		self.bufferChanged=threading.Condition()
+
 
-				
 		# readOneFrameToBuffer(self)
-		
+
 	def readOneFrameToBuffer(self):
 		ret,fr=self.videoIn.read()
 		if ret:
-			self.buffer.append(fr)
-			self.bufferZerothFrame+=1
+			self.buffer[self.bufferEndFrame%self.bufferSize]=fr
+			self.bufferEndFrame+=1
 		else:
-			print("ERROR!!!!")
+			self.endOfInput=True
+		return ret
 
 
 	def connectComponent(self,framesPerBlock):
 		#Returns the connected component ID
-		thisNNID=self.noConnectedComponents
-		self.noConnectedComponents+=1
-		self.connectedCoponentBlockSizes.append(framesPerBlock)
-		self.connectComponentNextFrame.append(0)
+		if framesPerBlock>self.bufferSize:
+			raise ValueError("Block size {} is larger than the buffer ({})".format(framesPerBlock,self.bufferSize))
+
+		with self.bufferChanged:
+			thisNNID=self.noConnectedComponents
+			self.noConnectedComponents+=1
+			self.connectedCoponentBlockSizes.append(framesPerBlock)
+			self.connectComponentNextFrame.append(self.bufferZerothFrame)		# Frames before it are gone
 
 		print("Connected NN {} with block size {}".format(thisNNID,self.connectedCoponentBlockSizes[thisNNID]))
 		return thisNNID
 		#Connected component ID
 
+	def disconnectComponent(self,requesterID):
+		# A finished component no longer holds frames in the buffer
+		with self.bufferChanged:
+			self.connectComponentNextFrame[requesterID]=None
+			self.cleanBuffer()
+
 	def cleanBuffer(self):
-		print("Dummy buffer cleaner")
-		
+		# Free the frames every component has passed (call with bufferChanged held)
+		nextFrames=[f for f in self.connectComponentNextFrame if f is not None]
+		oldest=min(nextFrames) if nextFrames else self.bufferEndFrame
+
+		for t in range(self.bufferZerothFrame,oldest):
+			self.buffer[t%self.bufferSize]=None
+		self.bufferZerothFrame=max(self.bufferZerothFrame,oldest)
+
+		self.bufferChanged.notify_all()
+
+
+	def getFrameBlock(self,requesterID,block=True,timeout=None):
+		"""
+		Next block of frames of the component (shorter at the end of the video, empty after it)
+		:param block: Wait for slower components when the block does not fit in the buffer yet
+			(with components on one thread use block=False, and serve the others when it returns None)
+		:return: list of frames, or None (not block, or timeout)
+		"""
+		with self.bufferChanged:
+			requestZerothFrame=self.connectComponentNextFrame[requesterID]
+			requestLastFrame=requestZerothFrame+self.connectedCoponentBlockSizes[requesterID]
+
+			while self.bufferEndFrame < requestLastFrame and not self.endOfInput:
+				if requestLastFrame-self.bufferZerothFrame <= self.bufferSize:
+					self.readOneFrameToBuffer()
+				elif not block or not self.bufferChanged.wait(timeout):
+					return None
 
-	def getFrameBlock(self,requesterID):
-		requestZerothFrame=self.connectComponentNextFrame[requesterID]
-		requestLastFrame=requestZerothFrame+self.connectedCoponentBlockSizes[requesterID]
-		
-		while self.bufferZerothFrame+len(self.buffer) < requestLastFrame:
-			self.readOneFrameToBuffer()
+			requestLastFrame=min(requestLastFrame,self.bufferEndFrame)
+			toReturn=[self.buffer[t%self.bufferSize] for t in range(requestZerothFrame,requestLastFrame)]
 
-		self.cleanBuffer()
+			self.connectComponentNextFrame[requesterID]=requestLastFrame
+			self.cleanBuffer()
 
-		toReturn= self.buffer[requestZerothFrame-self.bufferZerothFrame:requestZerothFrame-self.bufferZerothFrame]
 		print("Returning {} frames".format(len(toReturn)))
-		return toReturn
\ No newline at end of file
+		return toReturn
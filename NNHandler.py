@@ -1,21 +1,33 @@
 # from abc import ABC, abstractmethod
 import json
 
+from DetectionStore import DetectionStore
+
 class NNHandler:
 	def __init__(self):
 
 		self.time_series_length = None
 		self.json_data = None
+		self.json_stream = None		# suren.util.JsonStream when init_from_json(stream=True)
 
-	# def setInputBlockSize(self,N=32):
-	# 	self.inputBlockSize=N
+	def setInputBlockSize(self,N=32):
+		self.inputBlockSize=N
 	
-	# def getInputBlockSize(self):
-	# 	return self.inputBlockSize
+	def getInputBlockSize(self):
+		return self.inputBlockSize
+
+	def connectToInput(self,inputHandlerInstance):
+		# Share the frames decoded by an InputHandler with the other handlers connected to it
+		if not hasattr(self, "inputBlockSize"): self.setInputBlockSize()
+		self.myInput = inputHandlerInstance
+		self.myId = inputHandlerInstance.connectComponent(self.inputBlockSize)
 
-	# def connectToInput(self,inputHandlerInstance):
-	# 	self.myInput = inputHandlerInstance
-	# 	self.myId = inputHandlerInstance.connectComponent(self.inputBlockSize)
+	def getFrameBlock(self, block=True):
+		""" Next block of frames from the InputHandler (see InputHandler.getFrameBlock) """
+		return self.myInput.getFrameBlock(self.myId, block=block)
+
+	def disconnectFromInput(self):
+		self.myInput.disconnectComponent(self.myId)
 
 	def connectToGraph(self,gr):
 		self.graph = gr
@@ -28,6 +40,29 @@ class NNHandler:
 		pass
 		# raise NotImplementedError
 
+	def get_frames(self, start_time=None, end_time=None):
+		"""
+		Detections of the frames in [start_time, end_time), from json_data or streamed from the file
+		:return: iterator of (frame_index, detections), in frame order. Frames without detections are skipped
+		"""
+		if start_time is None: start_time = 0
+		if end_time is None: end_time = self.time_series_length
+
+		if self.json_data is None and self.json_stream is not None:
+			for t, detections in self.json_stream:
+				if end_time is not None and t >= end_time: break		# None while a JsonLines file is still written
+				if t >= start_time: yield t, detections
+			return
+
+		if isinstance(self.json_data, DetectionStore):
+			# Range scan over the frame index
+			yield from self.json_data.items(start_time, end_time)
+			return
+
+		for t in range(start_time, end_time):
+			if t in self.json_data: yield t, self.json_data[t]
+			elif str(t) in self.json_data: yield t, self.json_data[str(t)]		# If reading from json file
+
 
 
 
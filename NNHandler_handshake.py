@@ -2,7 +2,6 @@ import numpy as np
 import json
 import os, sys
 # from PIL import Image
-import matplotlib.pyplot as plt
 from collections import defaultdict
 import argparse
 
@@ -10,7 +9,7 @@ from NNHandler_yolo import NNHandler_yolo
 from NNHandler_image import NNHandler_image, cv2
 from Graph import Graph
 
-from suren.util import get_iou, Json, eprint, iou_batch
+from suren.util import get_iou, Json, eprint, iou_batch, iou_pairs
 
 
 class NNHandler_handshake(NNHandler_yolo):
@@ -50,12 +49,19 @@ class NNHandler_handshake(NNHandler_yolo):
 		print("\t[*] Handshake detector")
 
 	def update_handshake(self, start_time=None, end_time = None):
+		"""
+		Assign each handshake to the two people whose boxes overlap it the most (IOU)
+			- tracked (is_tracked) : one pair per handshake id, from the IOU averaged over the frames of the track.
+			  Boxes with id -1 are ignored (graph.state["handshake"] = 3)
+			- not tracked : every box is assigned on its own, to the pair of its frame (graph.state["handshake"] = 2).
+			  Before the batched version this branch was unreachable (nested under the tracked case), and untracked
+			  handshake files were not assigned at all
+		"""
 		if start_time is None: start_time = 0
 		if end_time is None: end_time = self.time_series_length
 
 		# Use self.graph and find the two people using maximum intersection area
 		graph = self.graph
-		handshake_data = self.json_data
 
 		# assert self.time_series_length == self.graph.time_series_length, \
 		# 	"Both files (yolo and graph) must be of same length :/ (%d, %d)" % (
@@ -165,82 +171,64 @@ class NNHandler_handshake(NNHandler_yolo):
 			graph.state["handshake"] = 2
 		'''
 
-		if self.is_tracked:
-			shakes = defaultdict(dict)
-
-			for t in handshake_data:
-				t_ = int(t)
-
-				if not (start_time <= t_ < end_time): continue
-
-				t_ -= start_time
-
-				# First take all the detected nodes at time t
-				node_t = [[node.params["xMin"][t_],
-						   node.params["yMin"][t_],
-						   node.params["xMax"][t_],
-						   node.params["yMax"][t_]] for node in graph.nodes]
-
-
-				# Next consider all handshake boxes at time t
-				for i, bbox in enumerate(handshake_data[t]):
-					bb_hs = [bbox["x1"], bbox["y1"], bbox["x2"], bbox["y2"]]
-
-					if self.is_tracked:
-						idx = bbox["id"]
-					else:
-						idx = i		# Random index to each HS
-
-					# iou between bb_hs and bb_person (node_t)
-					iou = iou_batch([bb_hs], node_t)
-
-					# print(iou) #, np.array(iou).shape)
-
-					# iou = list(map(lambda x: get_iou(bb_hs, x, mode=1), node_t))
-					shakes[idx][t_] = iou[0]
-
-			if -1 in shakes:
-				unclassified = shakes.pop(-1)	# non-id shakes
-
-			# print(shakes)
-
-			if self.is_tracked:
-				for idx in shakes:
-					shake_t = shakes[idx].keys()
-					shake_iou = list(shakes[idx].values())
-
-					# print(idx, shakes[idx])
-
-					shakes_iou_avg = np.mean(np.array(shake_iou), axis=0).astype(float)
-
-					# print(shakes_iou_avg)
-
-					p1, p2 = np.argpartition(shakes_iou_avg, -2)[-2:]
-					p1, p2 = int(p1), int(p2)
-
-					# print(graph.nodes)
-
-					for t in shake_t:
-						# print(t, p1, p2)
-						# print(graph.nodes[p1].params["handshake"])
-						graph.nodes[p1].params["handshake"][t] = {"person": p2, "confidence": None, "iou": shakes_iou_avg[p1]}
-						graph.nodes[p2].params["handshake"][t] = {"person": p1, "confidence": None, "iou": shakes_iou_avg[p2]}
-
-				graph.state["handshake"] = 3
+		# All handshake boxes in [start_time, end_time) : frame (of the graph), group and box
+		# Tracked boxes are grouped by id (one pair of people per handshake track). Otherwise each box is a group
+		frames, groups, boxes = [], [], []
+		for t, hs_bbox in self.get_frames(start_time, end_time):
+			for bbox in hs_bbox:
+				frames.append(t - start_time)
+				groups.append(bbox["id"] if self.is_tracked else len(groups))
+				boxes.extend((bbox["x1"], bbox["y1"], bbox["x2"], bbox["y2"]))
+
+		frames = np.array(frames, dtype=int)
+		groups = np.array(groups, dtype=int)
+		boxes = np.array(boxes, dtype=float).reshape((-1, 4))
+
+		# Groups in order of appearance. Non-id shakes are dropped, and a group keeps its last box of a frame
+		valid = groups != -1
+		frames, groups, boxes = frames[valid], groups[valid], boxes[valid]
+
+		group_ids, first, group_ind = np.unique(groups, return_index=True, return_inverse=True)
+		rank = np.argsort(np.argsort(first))[group_ind]
+
+		last = len(frames) - 1 - np.unique((rank * graph.time_series_length + frames)[::-1], return_index=True)[1]
+		last = last[np.lexsort((frames[last], rank[last]))]
+		frames, rank, boxes = frames[last], rank[last], boxes[last]
+
+		if len(frames) > 0:
+			# IOU of each handshake box with the people detected in its frame (0 for the rest)
+			hs_frames, hs_ind = np.unique(frames, return_inverse=True)
+			person_boxes = np.stack([graph.get_series(par, hs_frames) for par in ["xMin", "yMin", "xMax", "yMax"]], axis=-1)
+			k, n = np.nonzero(graph.get_series("detection", hs_frames)[:, hs_ind].T)
+
+			iou = np.zeros((len(frames), graph.n_nodes))
+			iou[k, n] = iou_pairs(boxes[k], person_boxes[n, hs_ind[k]])
+
+			# Average IOU of each group, and the two people with the largest
+			bounds = np.append(np.nonzero(np.diff(rank, prepend=-1))[0], len(rank))
+			iou_avg = np.array([np.mean(iou[a:b], axis=0) for a, b in zip(bounds[:-1], bounds[1:])])
+
+			pair = np.argpartition(iou_avg, -2, axis=1)[:, -2:]
+
+			if graph.columnar:
+				# Same writes as below (and in the same order), straight into the handshake columns
+				node = pair[rank].ravel()
+				partner = pair[rank][:, ::-1].ravel()
+				t = np.repeat(frames, 2)
+
+				hs = graph.columns["handshake"]
+				hs["person"][node, t] = partner
+				hs["confidence"][node, t] = np.nan
+				hs["iou"][node, t] = iou_avg[np.repeat(rank, 2), node]
+				hs["id"][node, t] = -1
 
 			else:
-				for idx in shakes:
-
-					for t in shakes[idx]:
-						t_ = int(t)
-						iou = shakes[idx][t]
-
-						p1, p2 = np.argpartition(iou, -2)[-2:]
-						p1, p2 = int(p1), int(p2)
+				for t, r in zip(frames, rank):
+					p1, p2 = int(pair[r, 0]), int(pair[r, 1])
+					graph.nodes[p1].params["handshake"][t] = {"person": p2, "confidence": None, "iou": iou_avg[r, p1]}
+					graph.nodes[p2].params["handshake"][t] = {"person": p1, "confidence": None, "iou": iou_avg[r, p2]}
 
-						graph.nodes[p1].params["handshake"][t_] = {"person": p2, "confidence": None, "iou": iou[p1]}
-						graph.nodes[p2].params["handshake"][t_] = {"person": p1, "confidence": None, "iou": iou[p2]}
-				graph.state["handshake"] = 2
+		graph.state["handshake"] = 3 if self.is_tracked else 2
 
 		print("[*] HS_handler : Updated the graph")
 
@@ -274,13 +262,9 @@ if __name__ == "__main__":
 
 	hs_handle = NNHandler_handshake(vis=args.visualize, is_tracked=args.tracked)
 
-	if os.path.exists(json_loc) and not args.overwrite:
-		# To load YOLO + DSORT track from json
-		hs_handle.init_from_json(json_loc)
-	else:
-		# To create YOLO + DSORT track and save to json
-		hs_handle.create_yolo(img_handle)
-		hs_handle.save_json(json_loc)
+	# YOLO + DSORT track from json (unless overwrite), else from the cache if this video was run with the same parameters,
+	# else created (and saved to json)
+	hs_handle.create_or_load(img_handle, json_file=json_loc, overwrite=args.overwrite)
 
 
 
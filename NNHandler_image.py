@@ -1,8 +1,12 @@
 import numpy as np
 import os
 import json
+import hashlib
+import queue
+import threading
 import cv2
 from glob import glob
+from collections import OrderedDict
 
 from NNHandler import NNHandler
 from suren.util import get_iou, Json, eprint
@@ -12,6 +16,9 @@ class NNHandler_image(NNHandler):
     VID_FORMAT = ["avi", "mp4", "ts"]
     IMG_FORMAT = ["jpg", "png"]
 
+    INDEX_STEP = 32     # frames between the seek points of the video index
+    CACHE_SIZE = 16     # decoded frames kept by read_frame
+
 
     def __init__(self, format, img_loc=None, json_file=None):
 
@@ -23,6 +30,9 @@ class NNHandler_image(NNHandler):
         self.json_file = json_file
 
         self.cap = None
+        self.pos = None         # frame returned by the next cap.read()
+        self.index = None       # seek points and frame timestamps of the video (load_index)
+        self.cache = OrderedDict()
         self.json_data = None
         self.time_series_length = None
 
@@ -53,22 +63,52 @@ class NNHandler_image(NNHandler):
         return "\n".join(lines)
 
     def count_frames(self, path=None):
+        """
+        (videos) The container frame count if it checks out, else a grab() pass (no pixel conversion).
+        Cached beside the video (<video>.frames.json, recounted if the video changes)
+        """
         if self.format in NNHandler_image.VID_FORMAT:
             if path is None: path = self.img_loc
+            if path == self.img_loc and self.index is not None: return len(self.index["timestamps"])
+
+            stat = os.stat(path)
+            key = {"size": stat.st_size, "mtime": stat.st_mtime}
+            count_file = path + ".frames.json"
+
+            if os.path.exists(count_file):
+                try:
+                    with open(count_file) as f:
+                        data = json.load(f)
+                    if all(data.get(k) == v for k, v in key.items()): return data["frames"]
+                except (OSError, ValueError, KeyError) as e:
+                    eprint("Cannot read the frame count :", e)
 
             cap = cv2.VideoCapture(path)
             # self.init_param(cap=cap)
 
-            total = 0
-            # loop over the frames of the video
-            while True:
-                (grabbed, frame) = cap.read()
-                if not grabbed:
-                    break
-                total += 1
+            # Metadata : the frame count is right if the last frame can be read and there is nothing after it
+            total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            if total > 0:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, total - 1)
+                if not (cap.grab() and not cap.grab()): total = 0
+
+            if total <= 0:
+                cap.release()
+                cap = cv2.VideoCapture(path)
+
+                total = 0
+                # loop over the frames of the video
+                while cap.grab():
+                    total += 1
 
             cap.release()
 
+            try:
+                with open(count_file, 'w') as f:
+                    json.dump(dict(key, frames=total), f)
+            except OSError as e:
+                eprint("Cannot save the frame count :", e)
+
             return total
 
         elif self.format in NNHandler_image.IMG_FORMAT:
@@ -83,13 +123,74 @@ class NNHandler_image(NNHandler):
     def open(self, start_frame:int = None, init_param = False):
         if self.format in NNHandler_image.VID_FORMAT:
             self.cap = cv2.VideoCapture(self.img_loc)
-            eprint("Frames will only be read linearly")
+            self.pos = 0
+            self.cache.clear()
 
             if init_param: self.init_param()
 
-            if start_frame is not None:
-                for i in range(start_frame):
-                    self.read_frame(i)
+            if start_frame: self.seek(start_frame)
+
+    def load_index(self):
+        """
+        Seek points of the video (frames where seeking gives the same frame as a linear decode) and the timestamp (ms)
+        of every frame. Built with one pass over the video the first time it is needed, and cached beside it
+        (<video>.index.npz, rebuilt if the video changes)
+        """
+        if self.index is not None: return self.index
+
+        index_file = self.img_loc + ".index.npz"
+        stat = os.stat(self.img_loc)
+
+        if os.path.exists(index_file):
+            try:
+                with np.load(index_file) as data:
+                    if data["size"] == stat.st_size and data["mtime"] == stat.st_mtime and data["step"] == self.INDEX_STEP:
+                        self.index = {"seek_points": data["seek_points"], "timestamps": data["timestamps"]}
+                        return self.index
+            except (OSError, ValueError, KeyError) as e:
+                eprint("Cannot read the frame index :", e)
+
+        self.index = self.build_index()
+        try:
+            np.savez(index_file, size=stat.st_size, mtime=stat.st_mtime, step=self.INDEX_STEP, **self.index)
+        except OSError as e:
+            eprint("Cannot save the frame index :", e)
+
+        return self.index
+
+    def build_index(self):
+        digest = lambda frame: hashlib.md5(frame.tobytes()).digest()
+
+        cap = cv2.VideoCapture(self.img_loc)
+        timestamps, candidates = [], {}
+        while cap.grab():
+            t = len(timestamps)
+            timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+            if t % self.INDEX_STEP == 0 and t > 0:
+                candidates[t] = digest(cap.retrieve()[1])
+
+        # The backend seeks from the keyframe before the frame. Keep the candidates where it is frame accurate
+        seek_points = [0]
+        for t, d in candidates.items():
+            cap.set(cv2.CAP_PROP_POS_FRAMES, t)
+            res, frame = cap.read()
+            if res and digest(frame) == d: seek_points.append(t)
+        cap.release()
+
+        return {"seek_points": np.array(seek_points, dtype=np.int64), "timestamps": np.array(timestamps, dtype=np.float64)}
+
+    def seek(self, frame_no):
+        """ Move the video to frame_no (the next cap.read() returns it) """
+        if not 0 <= frame_no - self.pos < self.INDEX_STEP:
+            seek_points = self.load_index()["seek_points"]
+            k = int(seek_points[np.searchsorted(seek_points, frame_no, side="right") - 1])
+            if not k <= self.pos <= frame_no:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, k)
+                self.pos = k
+
+        # Decode forward from there
+        while self.pos < frame_no and self.cap.grab():
+            self.pos += 1
 
     def init_param(self, cap=None):
         if cap is None: cap = self.cap
@@ -106,6 +207,8 @@ class NNHandler_image(NNHandler):
     def close(self):
         if self.format in NNHandler_image.VID_FORMAT:
             self.cap.release()
+            self.cap = None
+            self.cache.clear()
 
     def init_writer(self, out_name, h, w, fps=30, encoding="XVID"):
         fourcc = cv2.VideoWriter_fourcc(*'%s'%encoding)
@@ -119,16 +222,97 @@ class NNHandler_image(NNHandler):
         self.vid_out.release()
 
     def read_frame(self, frame_no=None):
+        """
+        :param frame_no: (videos) frame to read (default : the next frame). Reading in order is a plain decode,
+            other frames are reached from the closest seek point (load_index). Recent frames are cached
+        """
         if self.format in NNHandler_image.VID_FORMAT:
-            # raise NotImplementedError("Don't do this. It causes errors")
-            # self.cap.set(1, frame - 1)
-            res, frame = self.cap.read()
+            if frame_no is None: frame_no = self.pos
+
+            if frame_no in self.cache:
+                self.cache.move_to_end(frame_no)
+                return self.cache[frame_no].copy()
+
+            frame = self.decode_frame(frame_no)
+
+            if frame is not None and self.CACHE_SIZE > 0:
+                self.cache[frame_no] = frame.copy()
+                if len(self.cache) > self.CACHE_SIZE: self.cache.popitem(last=False)
 
             return frame
 
         elif self.format in NNHandler_image.IMG_FORMAT:
             return cv2.imread(self.json_data[str(frame_no)])
 
+    def decode_frame(self, frame_no):
+        """ read_frame without the cache (None after the last frame) """
+        if self.format in NNHandler_image.VID_FORMAT:
+            if frame_no != self.pos: self.seek(frame_no)
+            res, frame = self.cap.read()
+            if res: self.pos += 1
+            return frame if res else None
+
+        elif self.format in NNHandler_image.IMG_FORMAT:
+            return cv2.imread(self.json_data[str(frame_no)])
+
+    def prefetch(self, start_frame=None, end_frame=None, buffer=8, size=None, color=None):
+        """
+        Frames [start_frame, end_frame) decoded by a background thread, up to buffer frames ahead of the consumer
+        (cv2 releases the GIL while decoding, so decoding overlaps with the work done on the frames)
+        :param end_frame: (videos) default : until the video ends
+        :param size: (w, h) to resize the frames to, in the decode thread
+        :param color: cv2 colour conversion code (eg: cv2.COLOR_BGR2RGB), in the decode thread
+        :return: iterator of (frame_index, frame)
+        """
+        if start_frame is None: start_frame = 0
+        if end_frame is None and self.format not in NNHandler_image.VID_FORMAT: end_frame = self.time_series_length
+
+        opened = self.format in NNHandler_image.VID_FORMAT and self.cap is None
+        if opened: self.open()
+
+        frames = queue.Queue(maxsize=buffer)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    frames.put(item, timeout=.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def decode():
+            try:
+                t = start_frame
+                while end_frame is None or t < end_frame:
+                    frame = self.decode_frame(t)
+                    if frame is None: break
+
+                    if size is not None: frame = cv2.resize(frame, tuple(size))
+                    if color is not None: frame = cv2.cvtColor(frame, color)
+
+                    if not put((t, frame)): return
+                    t += 1
+            except Exception as e:
+                put(e)
+                return
+            put(None)
+
+        thread = threading.Thread(target=decode, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = frames.get()
+                if item is None: return
+                if isinstance(item, Exception): raise item
+                yield item
+        finally:
+            # Consumer done (or stopped early) : stop the decode thread before the capture is touched again
+            stop.set()
+            thread.join()
+            if opened: self.close()
+
     def init_from_img_loc(self, img_loc=None, show=False):
         img_loc = self.img_loc if img_loc is None else img_loc
         assert os.path.exists(img_loc), "Source image/video does not exist in path : %s"%img_loc
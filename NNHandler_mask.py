@@ -2,7 +2,6 @@ import numpy as np
 import json
 import os, sys
 # from PIL import Image
-import matplotlib.pyplot as plt
 from collections import defaultdict
 import argparse
 
@@ -105,20 +104,9 @@ if __name__ == "__main__":
 
 	nn_handle = NNHandler_mask(mask_file=json_loc, is_tracked=args.tracker, vis=args.visualize)
 
-	try:
-		if os.path.exists(json_loc):
-			if args.overwrite:
-				raise Exception("Overwriting json : %s" % json_loc)
-
-			# To load YOLO + DSORT track from json
-			nn_handle.init_from_json()
-
-		else:
-			raise Exception("Json does not exists : %s" % json_loc)
-	except:
-		# To create YOLO mask + DSORT track and save to json
-		nn_handle.create_yolo(img_handle, temp_name=True)
-		nn_handle.save_json()
+	# YOLO mask + DSORT track from json (unless overwrite), else from the cache if this video was run with the same
+	# parameters, else created (and saved to json)
+	nn_handle.create_or_load(img_handle, overwrite=args.overwrite, temp_name=True)
 
 
 	# g = Graph()
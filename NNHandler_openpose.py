@@ -2,7 +2,6 @@ import numpy as np
 import json
 import os, sys
 # from PIL import Image
-import matplotlib.pyplot as plt
 from collections import defaultdict
 from glob import glob
 
@@ -205,11 +204,13 @@ class NNHandler_openpose(NNHandler):
 		mot_tracker = Sort(max_age=1, min_hits=3, iou_threshold=.3)  # create instance of the SORT tracker
 		colours = np.random.rand(32, 3) *255  # used only for display
 
-		if img_handle is not None: img_handle.open()
+		if img_handle is not None:
+			img_handle.open()
+			frames = img_handle.prefetch(0, self.time_series_length)
 
 		for t in range(self.time_series_length):
 			# print(t)
-			if img_handle is not None: rgb = img_handle.read_frame(t)
+			if img_handle is not None: _, rgb = next(frames)
 
 			dets = []
 
@@ -255,7 +256,9 @@ class NNHandler_openpose(NNHandler):
 				if k & 0xff == ord('q'): break
 
 
-		if img_handle is not None: img_handle.close()
+		if img_handle is not None:
+			frames.close()
+			img_handle.close()
 
 
 #
@@ -2,8 +2,6 @@ import argparse
 import json
 import numpy as np
 import os, sys
-import matplotlib.pyplot as plt
-from collections import defaultdict
 
 from NNHandler_yolo import NNHandler_yolo
 from NNHandler_image import NNHandler_image, cv2
@@ -64,43 +62,50 @@ class NNHandler_person(NNHandler_yolo):
 		else: raise Exception("Graph is not empty")
 
 		assert len(graph.nodes) == 0, "Graph not empty. Cannot update non-empty graph"
+		graph.start_time = start_time
 
-		person_dic = defaultdict(dict)
-
-		for t in range(start_time, end_time):
-			try:
-				yolo_bbox = self.json_data[t]
-			except KeyError:
-				try:
-					yolo_bbox = self.json_data[str(t)]		# If reading from json file
-				except:
-					continue								# No boxes detected
-
+		# Flat (frame, id, box) of every detection in [start_time, end_time)
+		frames, ids, boxes = [], [], []
 
+		for t, yolo_bbox in self.get_frames(start_time, end_time):
 			for bbox in yolo_bbox:
-				idx = bbox["id"]
-				person_dic[idx][t] = bbox
-
-		if -1 in person_dic:
-			unclassified = person_dic.pop(-1)
-
-		# print(person_dic)
-
-		for idx in sorted(person_dic):
-			# TEMP SOLUTION FOR GIHAN
-
-			detected = {t : (True if t in person_dic[idx] else False) for t in range(start_time, end_time)}
-
-			x_min = [person_dic[idx][t]["x1"] if detected[t] else 0 for t in range(start_time, end_time)]
-			x_max = [person_dic[idx][t]["x2"] if detected[t] else 0 for t in range(start_time, end_time)]
-			y_min = [person_dic[idx][t]["y1"] if detected[t] else 0 for t in range(start_time, end_time)]
-			y_max = [person_dic[idx][t]["y2"] if detected[t] else 0 for t in range(start_time, end_time)]
-
-			detected = [detected[t] for t in detected]
+				frames.append(t - start_time)
+				ids.append(bbox["id"])
+				boxes.extend((bbox["x1"], bbox["x2"], bbox["y1"], bbox["y2"]))
+
+		frames = np.array(frames, dtype=int)
+		ids = np.array(ids, dtype=int)
+		boxes = np.array(boxes, dtype=object).reshape((-1, 4))
+
+		# Unclassified boxes (id -1) are dropped. Nodes are in order of id
+		valid = ids != -1
+		frames, ids, boxes = frames[valid], ids[valid], boxes[valid]
+		node_ids, rows = np.unique(ids, return_inverse=True)
+
+		# Scatter into N x T arrays (for a repeated (id, frame) the last box is kept, as the assignment is in order)
+		N, T = len(node_ids), graph.time_series_length
+		if graph.columnar:
+			graph.alloc_columns(N)
+			series = graph.columns
+		else:
+			# object arrays keep the values (and types) of the json file in the node lists
+			series = {par: np.zeros((N, T), dtype=object) for par in ["xMin", "xMax", "yMin", "yMax"]}
+			series["detection"] = np.zeros((N, T), dtype=bool)
+
+		for i, par in enumerate(["xMin", "xMax", "yMin", "yMax"]):
+			series[par][rows, frames] = boxes[:, i]
+		series["detection"][rows, frames] = True
+
+		for n, idx in enumerate(node_ids):
+			if graph.columnar:
+				p = Person(time_series_length=T, initParams={"id": int(idx)}, columns=(graph.columns, n))
+				for par in ["xMin", "yMin", "xMax", "yMax", "detection", "handshake"]:
+					p.params[par] = p.columnView(par)
+			else:
+				params = {par: series[par][n].tolist() for par in series}
+				params["id"] = int(idx)
+				p = Person(time_series_length=T, initParams=params)
 
-			p = Person(time_series_length=end_time-start_time,
-					   initParams={"id":idx, "xMin":x_min, "xMax":x_max, "yMin":y_min, "yMax":y_max, "detection":detected})
-			# print(idx, p.params)
 			graph.add_person(p)
 
 		graph.state["people"] = 2
@@ -142,10 +147,6 @@ if __name__=="__main__":
 	img_handle.runForBatch()
 
 	person_handler = NNHandler_person(json_file=json_loc, vis=args.visualize, is_tracked=args.tracked, verbose=args.verbose, debug=False)
-	if os.path.exists(json_loc) and not args.overwrite:
-		# To load YOLO + DSORT track from json
-		person_handler.init_from_json()
-	else:
-		# To create YOLO + DSORT track and save to json
-		person_handler.create_yolo(img_handle)
-		person_handler.save_json()
+	# YOLO + DSORT track from json (unless overwrite), else from the cache if this video was run with the same parameters,
+	# else created (and saved to json)
+	person_handler.create_or_load(img_handle, overwrite=args.overwrite)
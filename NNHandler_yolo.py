@@ -4,7 +4,6 @@ import numpy as np
 import os
 import sys
 from tqdm import tqdm
-import matplotlib.pyplot as plt
 from collections import defaultdict
 
 from NNHandler import NNHandler
@@ -12,28 +11,10 @@ from NNHandler_image import NNHandler_image, cv2
 
 from Node_Person import Person
 
-from suren.util import Json, eprint
-
-# This is only needed if running YOLO / deepsort
-# Not needed if the values are loaded from file
-try:
-	sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/submodules/yolov4-deepsort")
-
-	import tensorflow as tf
-	from tensorflow.python.saved_model import tag_constants
-
-	from deep_sort import preprocessing, nn_matching
-	from deep_sort.detection import Detection
-	from deep_sort.tracker import Tracker
-	from tools import generate_detections as gdet
-	import core.utils as utils
-
-	# NOT NEEDED in this code
-	# from core.yolov4 import filter_boxes
-	# from core.config import cfg
-
-except Exception as e:
-	eprint("Cannot run YOLO:", e)
+from DetectionStore import DetectionStore
+from DetectionCache import DetectionCache
+from DetectorBackend import YoloDetector, DeepSortTracker, detect_batches
+from suren.util import Json, JsonStream, JsonLines, eprint
 
 # def import_tracker(name="deepsort"):
 # 	if name == "deepsort":
@@ -69,6 +50,9 @@ class NNHandler_yolo(NNHandler):
 	score_thresh = .5
 	input_size = 416
 
+	encoder_batch_size = 32		# boxes per call of the deepsort appearance encoder
+	preprocess_workers = None	# threads resizing the frames for YOLO (None : cpu count)
+
 	@staticmethod
 	def YOLO_import():
 		raise NotImplementedError
@@ -117,224 +101,189 @@ class NNHandler_yolo(NNHandler):
 		self.verbose = verbose
 		self.debug = debug
 
-	def create_yolo(self, img_handle, temp_name=False):
+	def create_yolo(self, img_handle, temp_name=False, jsonl_file=None, resume=False, flush_every=100, batch_size=1,
+					detector=None, tracker=None):
 		"""
-		:param img_handle: NNHandler_image
+		:param img_handle: NNHandler_image (or DetectorBackend.SyntheticVideo)
+		:param batch_size: Frames per detector call. The tracker still gets the frames one by one, in order
+		:param detector: DetectorBackend. Default : YoloDetector (class attributes)
+		:param tracker: TrackerBackend. Default : DeepSortTracker (class attributes)
+		:param jsonl_file: Append the detections of every frame to this file as they are made (JsonLines) instead of
+			keeping them in memory. The handler then streams them from the file (json_stream)
+		:param resume: (jsonl_file) Continue after the last frame in jsonl_file
+		:param flush_every: (jsonl_file) Flush every flush_every frames
 		:return:
 		"""
 
-		# if not import_tracker(): raise Exception("Couldn't create tracker")
-		if not os.path.exists(self.yolo_dir): raise Exception("Couldn't find yolo_directory : %s" % (self.yolo_dir))
-		if not os.path.exists(self.model_filename): raise Exception("Couldn't find model : %s" % (self.model_filename))
-		if not os.path.exists(self.weigths_filename): raise Exception("Couldn't find weights : %s" % (self.weigths_filename))
-
 		tracked_person = {}
 
-		# Definition of the parameters
-		nms_max_overlap = self.nms_max_overlap
-		iou_thresh = self.iou_thresh
-		score_thresh = self.score_thresh
-		input_size = self.input_size
-
-		# YOLO encoder
-		encoder = gdet.create_box_encoder(self.model_filename, batch_size=1)
-
-		# initialize deep sort
-		if self.is_tracked:
-			max_cosine_distance = self.max_cosine_distance
-			nn_budget = self.nn_budget
-
-			# calculate cosine distance metric
-			metric = nn_matching.NearestNeighborDistanceMetric("cosine", max_cosine_distance, nn_budget)
-			# initialize tracker
-			tracker = Tracker(metric, n_init=3)
-		else:
-			tracker = None
-
-		saved_model_loaded = tf.saved_model.load(self.weigths_filename, tags=[tag_constants.SERVING])
-		infer = saved_model_loaded.signatures['serving_default']
-
-		frame_num = 0
-		img_handle.open()
-		for t in tqdm(range(img_handle.time_series_length)):
+		own_detector = detector is None		# closed here when done (its preprocessing threads)
+		if detector is None:
+			if not os.path.exists(self.weigths_filename): raise Exception("Couldn't find weights : %s" % (self.weigths_filename))
+			detector = YoloDetector(self.weigths_filename, self.input_size, self.iou_thresh, self.score_thresh,
+									preprocess_workers=self.preprocess_workers)
 
-			frame = img_handle.read_frame(t)
-			frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-			frame_num += 1
+		try:
+			if tracker is None:
+				# if not import_tracker(): raise Exception("Couldn't create tracker")
+				if not os.path.exists(self.yolo_dir): raise Exception("Couldn't find yolo_directory : %s" % (self.yolo_dir))
+				if not os.path.exists(self.model_filename): raise Exception("Couldn't find model : %s" % (self.model_filename))
 
-			if self.verbose: print('Frame #: ', frame_num)
-			# if t < 1000: continue
+				tracker = DeepSortTracker(self.model_filename, is_tracked=self.is_tracked, class_names=self.class_names,
+										  nms_max_overlap=self.nms_max_overlap, max_cosine_distance=self.max_cosine_distance,
+										  nn_budget=self.nn_budget, encoder_batch_size=self.encoder_batch_size, debug=self.debug)
 
-			frame_size = frame.shape[:2]
-			image_data = cv2.resize(frame, (input_size, input_size))
-			image_data = image_data / 255.
-			image_data = image_data[np.newaxis, ...].astype(np.float32)
-
-			# run detections on tflite if flag is set
-
-			batch_data = tf.constant(image_data)
-			pred_bbox = infer(batch_data)
-			for key, value in pred_bbox.items():
-				boxes = value[:, :, 0:4]
-				pred_conf = value[:, :, 4:]
-
-			# print(boxes, pred_conf)
-
-			# WTF : why a loop above???
-			boxes, scores, classes, valid_detections = tf.image.combined_non_max_suppression(
-				boxes=tf.reshape(boxes, (tf.shape(boxes)[0], -1, 1, 4)),
-				scores=tf.reshape(
-					pred_conf, (tf.shape(pred_conf)[0], -1, tf.shape(pred_conf)[-1])),
-				max_output_size_per_class=50,
-				max_total_size=50,
-				iou_threshold=iou_thresh,
-				score_threshold=score_thresh
-			)
-
-			# convert data to numpy arrays and slice out unused elements
-			num_objects = valid_detections.numpy()[0]
-			bboxes = boxes.numpy()[0]
-			bboxes = bboxes[0:int(num_objects)]
-			scores = scores.numpy()[0]
-			scores = scores[0:int(num_objects)]
-			classes = classes.numpy()[0]
-			classes = classes[0:int(num_objects)]
-
-			# print(num_objects, bboxes, scores, classes)
-
-			# format bounding boxes from normalized ymin, xmin, ymax, xmax ---> xmin, ymin, width, height
-			original_h, original_w, _ = frame.shape
-			bboxes = utils.format_boxes(bboxes, original_h, original_w)
-
-			# store all predictions in one parameter for simplicity when calling functions
-			pred_bbox = [bboxes, scores, classes, num_objects]
-
-			if self.debug:
-				print("[xx]", pred_bbox)
-
-
-			if self.class_names is None:
-				# Give class names
-				names = ["class_%d" % i for i in classes]
-				eprint("[xx]", classes)
-
-			else:
-				# custom allowed classes (uncomment line below to customize tracker for only people)
-				allowed_classes = self.class_names
-
-				# loop through objects and use class index to get class name, allow only classes in allowed_classes list
-				names = []
-				deleted_indx = []
-				for i, idx in enumerate(classes):
-					# print(i, idx, len(allowed_classes))
-					if int(idx) < len(allowed_classes):
-						names.append(allowed_classes[int(idx)])
-					else:
-						deleted_indx.append(i)
-
-				names = np.array(names)
-				count = len(names)
-
-				# delete detections that are not in allowed_classes
-				bboxes = np.delete(bboxes, deleted_indx, axis=0)
-				scores = np.delete(scores, deleted_indx, axis=0)
-
-
-			# encode yolo detections and feed to tracker
-			features = encoder(frame, bboxes)
-			detections = [Detection(bbox, score, class_name, feature) for bbox, score, class_name, feature in
-						  zip(bboxes, scores, names, features)]
+			writer, start, id_offset = None, 0, 0
+			if jsonl_file is not None:
+				writer = JsonLines(jsonl_file, flush_every=flush_every)
+				start = writer.open(resume=resume)
+				id_offset = writer.max_id + 1		# The tracker starts over : ids of a resumed run follow the ones written
 
 			# initialize color map
-			cmap = plt.get_cmap('tab20b')
-			colors = [cmap(i)[:3] for i in np.linspace(0, 1, 20)]
-
-			# run non-maxima supression
-			boxs = np.array([d.tlwh for d in detections])
-			scores = np.array([d.confidence for d in detections])
-			classes = np.array([d.class_name for d in detections])
+			if self.visualize:
+				import matplotlib.pyplot as plt		# slow to import : only when drawing
+				cmap = plt.get_cmap('tab20b')
+				colors = [cmap(i)[:3] for i in np.linspace(0, 1, 20)]
 
-			indices = preprocessing.non_max_suppression(boxs, classes, nms_max_overlap, scores)
-			detections = [detections[i] for i in indices]
+			frame_num = start
+			img_handle.open(start_frame=start if start > 0 else None)
+			# Frames are decoded (and converted to RGB) in the background while the detector runs
+			frames = img_handle.prefetch(start, img_handle.time_series_length, color=cv2.COLOR_BGR2RGB)
+			# Detections are made batch_size frames at a time. The tracker takes them frame by frame
+			detections_t = detect_batches(frames, detector, batch_size)
+			for t, frame, detections in tqdm(detections_t, total=img_handle.time_series_length - start):
 
-			# print(detections)
+				frame_num += 1
 
-			# Call the tracker
-			if self.is_tracked:
-				tracker.predict()
-				tracker.update(detections)
+				if self.verbose: print('Frame #: ', frame_num)
+				# if t < 1000: continue
 
-				detections = tracker.tracks
+				person_t = tracker.update(t, frame, detections)
 
-			person_t = []
+				# confirmed tracks
+				for dic in person_t:
+					if "name" not in dic: continue
 
-			# update tracks
-			for track in detections:
+					if dic["id"] != -1: dic["id"] += id_offset
+					bbox, id, class_name = (dic["x1"], dic["y1"], dic["x2"], dic["y2"]), dic["id"], dic["name"]
 
-				# Get confidence (@suren : Don't think this is needed. Just uncomment/delet)
+					# draw bbox on screen
+					txt = class_name + "-" + str(id) if self.is_tracked else class_name
 
-				if self.is_tracked and (not track.is_confirmed() or track.time_since_update > 1):
-					if not track.is_confirmed():
-						bbox = track.to_tlbr()
-						person_t.append({
-							"x1": bbox[0], "y1": bbox[1], "x2": bbox[2], "y2": bbox[3], "id": -1
-						})
+					if self.visualize:
+						color = colors[int(id) % len(colors)]
+						color = [i * 255 for i in color]
 
-					continue
+						cv2.rectangle(frame, (int(bbox[0]), int(bbox[1])), (int(bbox[2]), int(bbox[3])), color, 2)
+						cv2.rectangle(frame, (int(bbox[0]), int(bbox[1] - 30)),
+									  (int(bbox[0]) + len(txt) * 17, int(bbox[1])), color, -1)
+						cv2.putText(frame, txt, (int(bbox[0]), int(bbox[1] - 10)), 0, 0.75, (255, 255, 255), 2)
 
-				bbox = track.to_tlbr()
-				class_name = track.get_class()
+					# if enable info flag then print details about each track
+					if self.verbose:
+						print("Tracker ID: {}, Class: {},  BBox Coords (xmin, ymin, xmax, ymax): {}".format(
+							str(id), class_name, (int(bbox[0]), int(bbox[1]), int(bbox[2]), int(bbox[3]))))
 
-				# draw bbox on screen
-				if self.is_tracked:
-					id = track.track_id
-					txt = class_name + "-" + str(track.track_id)
-				else:
-					id = -1
-					txt = class_name
+					if not temp_name: del dic["name"]
 
 				if self.visualize:
-					color = colors[int(id) % len(colors)]
-					color = [i * 255 for i in color]
-
-					cv2.rectangle(frame, (int(bbox[0]), int(bbox[1])), (int(bbox[2]), int(bbox[3])), color, 2)
-					cv2.rectangle(frame, (int(bbox[0]), int(bbox[1] - 30)),
-								  (int(bbox[0]) + len(txt) * 17, int(bbox[1])), color, -1)
-					cv2.putText(frame, txt, (int(bbox[0]), int(bbox[1] - 10)), 0, 0.75, (255, 255, 255), 2)
-
-				# if enable info flag then print details about each track
-				if self.verbose:
-					print("Tracker ID: {}, Class: {},  BBox Coords (xmin, ymin, xmax, ymax): {}".format(
-						str(id), class_name, (int(bbox[0]), int(bbox[1]), int(bbox[2]), int(bbox[3]))))
-
-				dic = {"x1": bbox[0], "y1": bbox[1], "x2": bbox[2], "y2": bbox[3], "id": id}
-
-				if temp_name: dic["name"] = class_name
+					# result = np.asarray(frame)
+					result = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+					cv2.imshow("Output Video", result)
+					if cv2.waitKey(20) & 0xFF == ord('q'): break
 
-				person_t.append(dic)
-
-			# result = np.asarray(frame)
-			result = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+				if len(person_t) > 0:
+					if writer is not None: writer.write(t, person_t)
+					else: tracked_person[t] = person_t
 
+			frames.close()
 			if self.visualize:
-				cv2.imshow("Output Video", result)
-				if cv2.waitKey(20) & 0xFF == ord('q'): break
+				cv2.destroyAllWindows()
 
-			if len(person_t) > 0: tracked_person[t] = person_t
+			self.time_series_length = frame_num
+			if writer is not None:
+				writer.close(frames=frame_num)
+				self.json_stream = JsonLines(jsonl_file)
+				self.json_data = None
+			else:
+				self.json_data = tracked_person
+		finally:
+			if own_detector: detector.close()
 
-		if self.visualize:
-			cv2.destroyAllWindows()
+	def create_or_load(self, img_handle, cache=None, json_file=None, overwrite=False, **kwargs):
+		"""
+		Detections of the video, from the first of : json_file if it exists, the cache if the video was run with the
+		same parameters, create_yolo (then saved to the cache and to json_file)
+		:param img_handle: NNHandler_image (None : load json_file)
+		:param cache: DetectionCache (None : default one)
+		:param json_file: default : self.json_file
+		:param overwrite: Run the detector even if json_file exists or the cache has the video (both are replaced)
+		:param kwargs: create_yolo arguments. With a detector or tracker (not the default YOLO + deepsort, whose
+			parameters make the key) the cache is not used
+		"""
+		if json_file is None: json_file = self.json_file
+		if img_handle is None or (not overwrite and json_file is not None and os.path.exists(json_file)):
+			# The parameters it was made with are unknown : used as is, not added to the cache
+			return self.init_from_json(json_file)
+
+		if kwargs.get("detector") is not None or kwargs.get("tracker") is not None:
+			self.create_yolo(img_handle, **kwargs)
+			if json_file is not None: self.save_json(json_file)
+			return
+
+		if cache is None: cache = DetectionCache()
+		desc = cache.describe(self, img_handle, temp_name=kwargs.get("temp_name", False))
+		key = cache.key(desc)
+
+		dir_name = None if overwrite else cache.get(key)
+		if dir_name is not None:
+			if self.verbose: print("\t[*] Cached detections : %s" % dir_name)
+			self.init_from_json(dir_name)
+		else:
+			self.create_yolo(img_handle, **kwargs)
+			desc["source"] = img_handle.img_loc
+			cache.put(key, self, desc, overwrite=overwrite)
 
-		self.time_series_length = frame_num
-		self.json_data = tracked_person
+		if json_file is not None: self.save_json(json_file)
 
-	def init_from_json(self, file_name=None):
+	def init_from_json(self, file_name=None, stream=False):
+		"""
+		:param file_name: json file, or binary detection store (DetectionStore, a directory)
+		:param stream: Only read the header. Frames are then parsed from the file as get_frames() needs them
+		"""
 		if file_name is None: file_name = self.json_file
 		if file_name is None or not os.path.exists(file_name): raise ValueError("Json File does not exists : %s"%file_name)
 
 		if self.verbose:
 			print("\t[*] Init from file : %s"%file_name)
 
+		if file_name.endswith(".jsonl"):
+			# Per frame lines (create_yolo(jsonl_file=...))
+			lines = JsonLines(file_name)
+			self.time_series_length = lines.frames()		# frames written so far if the run was interrupted
+			self.ftype = "jsonl"
+			if stream:
+				self.json_stream = lines
+				self.json_data = None
+				return self.json_stream
+
+			self.json_data = {str(t): dets for t, dets in lines}
+			return self.json_data
+
+		if DetectionStore.is_store(file_name):
+			# Memory mapped. Frames are read as they are used (json_data is a DetectionStore)
+			self.json_data = DetectionStore.load(file_name)
+			self.time_series_length = self.json_data.time_series_length
+			self.ftype = "store"
+			return self.json_data
+
+		if stream:
+			self.json_stream = JsonStream(file_name)
+			self.time_series_length = self.json_stream.read_header()["frames"]
+			self.json_data = None
+			self.ftype = "json"
+			return self.json_stream
+
 		with open(file_name, 'r') as json_file:
 			data = json.load(json_file)
 
@@ -346,13 +295,28 @@ class NNHandler_yolo(NNHandler):
 		return self.json_data
 
 	def save_json(self, file_name=None):
+		"""
+		:param file_name: json file, or binary detection store if it ends with DetectionStore.EXT
+		"""
 		if file_name is None: file_name = self.json_file
 		if not os.path.exists(os.path.dirname(file_name)) : os.makedirs(os.path.dirname(file_name))
 
+		json_data = self.json_data
+		if json_data is None and self.json_stream is not None:
+			json_data = {str(t): dets for t, dets in self.get_frames()}
+
+		if file_name.endswith(DetectionStore.EXT):
+			store = json_data
+			if not isinstance(store, DetectionStore):
+				store = DetectionStore.from_dict(json_data, self.time_series_length)
+			store.save(file_name)
+			self.ftype = "store"
+			return
+
 		js = Json(file_name)
 		dic = {"frames": self.time_series_length}
-		for i in self.json_data:
-			dic[i] = self.json_data[i]
+		for i in json_data:
+			dic[i] = json_data[i]
 
 		self.ftype = "json"
 
@@ -8,6 +8,7 @@ class Node:
         self.params = {}
         self.idx = idx          # id is inbuilt. Dont use
         self.type = None
+        self.columns = None     # (dict of N x T arrays, row) if the graph stores the time series (columnar mode)
 
         if initParams is not None:
             self.setParamsFromDict(initParams)
@@ -15,8 +16,18 @@ class Node:
     def setType(self, ty):
         self.type = ty
 
+    def isColumn(self, param):
+        return self.columns is not None and param in self.columns[0]
+
+    def columnView(self, param):
+        columns, row = self.columns
+        return columns[param][row]
+
     def addParam(self, param):
-        self.params[param] = [None for _ in range(self.time_series_length)]
+        if self.isColumn(param):
+            self.params[param] = self.columnView(param)
+        else:
+            self.params[param] = [None for _ in range(self.time_series_length)]
 
     def addStaticParam(self, param, val):
         self.params[param] = val
@@ -29,7 +40,15 @@ class Node:
         return self.params[paramName][t]
 
 
+    def setSeries(self, paramName, val):
+        # Write in place if the graph owns this time series
+        if self.isColumn(paramName):
+            if paramName not in self.params: self.addParam(paramName)
+            self.params[paramName][:] = val
+        else:
+            self.params[paramName] = val
+
     def setParamsFromDict(self, dic):
         for par in dic:
-            self.params[par] = dic[par]
+            self.setSeries(par, dic[par])
         # self.params = dic
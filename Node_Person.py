@@ -2,13 +2,61 @@ from Node import *
 import os
 import numpy as np
 
+class HandshakeSeries:
+	"""
+	Handshake dicts of a person ({"person", "confidence", "iou", "id"} per frame) when the graph
+	stores them as N x T columns (columnar mode). Reads and writes go straight to the columns.
+	"""
+
+	# field : (dtype, value stored for None). Node indices and track ids fit in int32
+	FIELDS = {"person": (np.int32, -1), "confidence": (np.float64, np.nan), "iou": (np.float64, np.nan), "id": (np.int32, -1)}
+
+	def __init__(self, columns, row):
+		self.columns = columns
+		self.row = row
+
+	def __len__(self):
+		return self.columns["handshake"]["person"].shape[1]
+
+	def __iter__(self):
+		for t in range(len(self)):
+			yield self[t]
+
+	def __getitem__(self, t):
+		if isinstance(t, slice):
+			return [self[i] for i in range(*t.indices(len(self)))]
+
+		hs = self.columns["handshake"]
+		dic = {}
+		for key, (dtype, none) in HandshakeSeries.FIELDS.items():
+			val = hs[key][self.row, t]
+			is_none = np.isnan(val) if np.issubdtype(dtype, np.floating) else val == none
+			dic[key] = None if is_none else val.item()
+		return dic
+
+	def __setitem__(self, t, dic):
+		if isinstance(t, slice):
+			for i, d in zip(range(*t.indices(len(self))), dic):
+				self[i] = d
+			return
+
+		hs = self.columns["handshake"]
+		for key, (dtype, none) in HandshakeSeries.FIELDS.items():
+			val = dic.get(key)
+			hs[key][self.row, t] = none if val is None else val
+
+	def tolist(self):
+		return list(self)
+
+
 class Person(Node):
 
-	def __init__(self, isLocation2D=True, initParams=None, time_series_length=None, idx=None):
+	def __init__(self, isLocation2D=True, initParams=None, time_series_length=None, idx=None, columns=None):
 		"""
 		@gihan what are these params
 		:param isLocation2D: ??? @gihan
 		:param time_series_length: Number of time samples
+		:param columns: (graph columns, row) to bind to. Time series are then not initialized here
 		"""
 
 		super().__init__(initParams=None, time_series_length=time_series_length, idx=idx)
@@ -16,8 +64,11 @@ class Person(Node):
 		self.location2D=isLocation2D
 		# self.type = 'Person'
 
-		self.init_pos()
-		self.init_handshake()
+		if columns is None:
+			self.init_pos()
+			self.init_handshake()
+		else:
+			self.columns = columns
 
 		if initParams is not None:
 			self.setParamsFromDict(initParams)
@@ -32,6 +83,11 @@ class Person(Node):
 	# 	self.params["Y"][0]=Y
 
 
+	def columnView(self, param):
+		if param == "handshake":
+			return HandshakeSeries(*self.columns)
+		return super().columnView(param)
+
 	def init_handshake(self):
 		# print("Initializing handshake")
 		self.params["handshake"]=[{"person":None,"confidence":None, "iou":None, "id":None} for _ in range(self.time_series_length)]
@@ -108,7 +164,7 @@ class Person(Node):
 
 		self.calculate_standing_locations()
 		self.calculate_detected_time_period(debug=debug)
-		self.params["interpolated"]=[False for _ in range(self.time_series_length)]
+		self.setSeries("interpolated", [False for _ in range(self.time_series_length)])
 
 		if not self.params["neverDetected"]:
 			t1=self.params["detectionStartT"]
@@ -161,7 +217,7 @@ class Person(Node):
 
 		f_name = os.path.basename(__file__)
 
-		self.params["interpolated"]=[False for _ in range(self.time_series_length)]
+		self.setSeries("interpolated", [False for _ in range(self.time_series_length)])
 
 		if "X" not in self.params.keys() or  "Y" not in self.params.keys():
 			self.calculate_standing_locations()
@@ -205,5 +261,5 @@ class Person(Node):
 		projected[0, :] /= projected[2, :]
 		projected[1, :] /= projected[2, :]
 
-		self.params["X_project"] = projected[0, :].tolist()
-		self.params["Y_project"] = projected[1, :].tolist()
+		self.setSeries("X_project", projected[0, :].tolist())
+		self.setSeries("Y_project", projected[1, :].tolist())
@@ -0,0 +1,189 @@
+import argparse
+import numpy as np
+from collections import deque
+
+from Graph import Graph
+from suren.util import iou_batch
+
+
+class OnlineGraph(Graph):
+	"""
+	Streaming version of generateFloorMap + findClusters + calculateThreatLevel for live feeds.
+	Detections are fed a block of frames at a time with update(). Only the new frames are projected
+	and scored, so the work per frame depends on the people in view and not on the frames seen so far.
+
+	The offline analysis sees the whole timeline. Here,
+		- undetected people keep their last projected position (no interpolation) and are dropped
+		  MAX_AGE frames after their last detection, with their running sums (an id seen again later starts over)
+		- a pair is counted (pairDetectionProbability = 1) in the frames where both people are tracked
+		- the group probability of a pair is the ratio over the frames seen so far (running sums)
+
+	The state only holds the people in view (nodes 0 .. n_nodes - 1, compacted when people are dropped), so memory
+	and work per frame do not grow with the ids seen. frameThreatLevel keeps the last `history` frames.
+	"""
+
+	def __init__(self, max_age=30, save_name=None, history=10000):
+		"""
+		:param history: Frames kept in frameThreatLevel (None : all)
+		"""
+		super().__init__(time_series_length=0, save_name=save_name)
+
+		self.MAX_AGE = max_age
+
+		self.id2node = {}							# tracking id -> node index (people in view)
+		self.nodeId = np.zeros(0, dtype=int)		# node index -> tracking id
+		self.lastPosition = np.zeros((0, 2), dtype=np.float32)	# last projected (X, Y) of each node
+		self.lastSeen = np.zeros(0, dtype=int)		# last frame each node was detected
+
+		# Running sums of findClusters : sum(group * pairDetection), sum(pairDetection)
+		self.groupSum = np.zeros((0, 0), dtype=np.float32)
+		self.pairDetectionSum = np.zeros((0, 0), dtype=np.float32)
+
+		self.frameThreatLevel = deque(maxlen=history)
+
+	def resize(self, keep, cap):
+		""" Keep nodes `keep` (in order, as 0 .. len(keep) - 1) in arrays of cap nodes """
+		k = len(keep)
+		lastPosition = np.zeros((cap, 2), dtype=np.float32)
+		lastSeen = np.full(cap, -1, dtype=int)
+		nodeId = np.full(cap, -1, dtype=int)
+		lastPosition[:k], lastSeen[:k], nodeId[:k] = self.lastPosition[keep], self.lastSeen[keep], self.nodeId[keep]
+		self.lastPosition, self.lastSeen, self.nodeId = lastPosition, lastSeen, nodeId
+
+		for name in ["groupSum", "pairDetectionSum"]:
+			arr = np.zeros((cap, cap), dtype=np.float32)
+			arr[:k, :k] = getattr(self, name)[np.ix_(keep, keep)]
+			setattr(self, name, arr)
+
+	def grow(self, n):
+		""" Make room for n nodes """
+		cap = len(self.lastSeen)
+		if n <= cap: return
+		self.resize(np.arange(self.n_nodes), max(16, 2 * cap, n))
+
+	def evict(self, t):
+		""" Drop the people not detected since frame t - MAX_AGE (nodes are renumbered) """
+		n = self.n_nodes
+		keep = np.nonzero(self.lastSeen[:n] >= t - self.MAX_AGE)[0]
+		if len(keep) == n: return
+
+		for idx in self.nodeId[:n][self.lastSeen[:n] < t - self.MAX_AGE]:
+			del self.id2node[idx]
+
+		# Smaller arrays if few people are left
+		cap = len(self.lastSeen)
+		if cap > max(16, 4 * len(keep)): cap = max(16, 2 * len(keep))
+		self.resize(keep, cap)
+
+		self.n_nodes = len(keep)
+		for node, idx in enumerate(self.nodeId[:self.n_nodes]):
+			self.id2node[idx] = node
+
+	def get_node(self, idx):
+		if idx not in self.id2node:
+			self.grow(self.n_nodes + 1)
+			self.id2node[idx] = self.n_nodes
+			self.nodeId[self.n_nodes] = idx
+			self.n_nodes += 1
+			self.n_person += 1
+		return self.id2node[idx]
+
+	def update(self, frame_block, handshake_block=None):
+		"""
+		:param frame_block: list of frames, each the list of person bboxes ({"x1", "y1", "x2", "y2", "id"}) of that
+			frame, as in the yolo json files
+		:param handshake_block: Same for handshake bboxes (optional)
+		:return: threat level of the new frames
+		"""
+		if handshake_block is None: handshake_block = [[] for _ in frame_block]
+		assert len(frame_block) == len(handshake_block), "Need handshake boxes for every frame in the block"
+
+		threat = np.zeros(len(frame_block), dtype=np.float32)
+		for k, (person_t, hs_t) in enumerate(zip(frame_block, handshake_block)):
+			threat[k] = self.update_frame(person_t, hs_t)
+		return threat
+
+	def update_frame(self, person_t, hs_t):
+		t = self.time_series_length
+
+		# Floor projection of this frame only (same standing point as Person.calculate_standing_locations)
+		person_t = [bbox for bbox in person_t if bbox["id"] != -1]
+		det = np.array([self.get_node(bbox["id"]) for bbox in person_t], dtype=int)
+		boxes = np.array([[bbox["x1"], bbox["y1"], bbox["x2"], bbox["y2"]] for bbox in person_t], dtype=float).reshape(-1, 4)
+
+		if len(det) > 0:
+			XY = np.array([(boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 3], np.ones(len(det))])
+			XY[0] = XY[0].astype(int)
+			projected = np.dot(self.transMatrix, XY)
+			self.lastPosition[det, 0] = projected[0] / projected[2]
+			self.lastPosition[det, 1] = projected[1] / projected[2]
+			self.lastSeen[det] = t
+
+		self.evict(t)
+		det = np.array([self.id2node[bbox["id"]] for bbox in person_t], dtype=int)
+
+		alive = np.arange(self.n_nodes)
+		A = len(alive)
+		ix = np.ix_(alive, alive)
+
+		# Running group probability
+		XY = self.lastPosition[alive]
+		dist = np.sqrt(np.sum(np.power(XY[:, None, :] - XY[None, :, :], 2), axis=-1))
+		pdp = ~np.eye(A, dtype=bool)
+
+		self.groupSum[ix] += (dist < self.GROUP_DIST_THRESH) & pdp
+		self.pairDetectionSum[ix] += pdp
+		with np.errstate(invalid="ignore", divide="ignore"):
+			g = (self.groupSum[ix] / self.pairDetectionSum[ix]) > self.GROUP_TIME_THRESH
+
+		# Handshake : the two people of this frame that overlap the handshake box the most
+		i = np.zeros((A, A), dtype=bool)
+		pos = {n: a for a, n in enumerate(alive)}
+		if len(det) >= 2:
+			for bbox in hs_t:
+				iou = iou_batch([[bbox["x1"], bbox["y1"], bbox["x2"], bbox["y2"]]], boxes)[0]
+				ind1, ind2 = np.argpartition(iou, -2)[-2:]
+				p1, p2 = pos[det[ind1]], pos[det[ind2]]
+				i[p1, p2] = i[p2, p1] = True
+
+		EPS_m = 2.0
+		EPS_g = 2.0
+		m = 0.0		# get from graph self.nodes @Suren
+		d = np.exp(-1.0*dist/self.DISTANCE_TAU)
+		threatLevel = np.sum((d+i)*(EPS_m-m)*(EPS_g-g)*pdp)
+
+		self.frameThreatLevel.append(threatLevel)
+		self.time_series_length += 1
+
+		return threatLevel
+
+
+if __name__ == "__main__":
+	# Replay a yolo + handshake label file as a live feed
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--person", "-p", type=str, default="./data/labels/DEEE/yolo/cctv9-yolo.json")
+	parser.add_argument("--handshake", "--hs", type=str, default="./data/labels/DEEE/handshake/cctv9-hs.json")
+	parser.add_argument("--cam", "-c", type=str, default="./data/camera-orientation/jsons/deee.json")
+	parser.add_argument("--block", "-b", type=int, default=32)
+	args = parser.parse_args()
+
+	from NNHandler_person import NNHandler_person
+	from NNHandler_handshake import NNHandler_handshake
+
+	person_handle = NNHandler_person(args.person, verbose=False)
+	person_handle.init_from_json()
+	hs_handle = NNHandler_handshake(args.handshake, verbose=False)
+	hs_handle.init_from_json()
+
+	g = OnlineGraph()
+	g.getCameraInfoFromJson(args.cam)
+
+	T = person_handle.time_series_length
+	for t1 in range(0, T, args.block):
+		t2 = min(t1 + args.block, T)
+		person_block = [person_handle.json_data.get(str(t), []) for t in range(t1, t2)]
+		hs_block = [hs_handle.json_data.get(str(t), []) for t in range(t1, t2)]
+
+		threat = g.update(person_block, hs_block)
+		print("Frames {} - {} : max threat {:.4f}".format(t1, t2, np.max(threat)))
@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class SparsePairTensor:
+	"""
+	T x P x P pair tensor (pairD, pairI, ...) that only stores the co-detected pairs of each frame.
+
+	Entries of frame t are values[offsets[t]:offsets[t+1]] at (p1, p2). Indexing with a frame
+	(pairT[t] or pairT[t, :, :]) returns the dense P x P matrix of that frame.
+	Several tensors of the same graph can share offsets, p1 and p2.
+	"""
+
+	def __init__(self, shape, offsets, p1, p2, values):
+		self.shape = tuple(shape)
+		self.offsets = offsets
+		self.p1 = p1
+		self.p2 = p2
+		self.values = values
+
+		assert len(self.offsets) == self.shape[0] + 1, "Need one offset per frame (+1)"
+		assert len(self.p1) == len(self.p2) == len(self.values), "Index and value arrays must be of same length"
+
+	def __repr__(self):
+		return "SparsePairTensor(shape={}, nnz={})".format(self.shape, self.nnz)
+
+	def __len__(self):
+		return self.shape[0]
+
+	@property
+	def nnz(self):
+		return len(self.values)
+
+	@property
+	def nbytes(self):
+		return self.offsets.nbytes + self.p1.nbytes + self.p2.nbytes + self.values.nbytes
+
+	@property
+	def dtype(self):
+		return self.values.dtype
+
+	def frame(self, t):
+		_, P1, P2 = self.shape
+		a, b = self.offsets[t], self.offsets[t+1]
+
+		out = np.zeros((P1, P2), dtype=self.values.dtype)
+		out[self.p1[a:b], self.p2[a:b]] = self.values[a:b]
+		return out
+
+	def __getitem__(self, key):
+		if isinstance(key, tuple):
+			t, rest = key[0], key[1:]
+		else:
+			t, rest = key, ()
+
+		if isinstance(t, slice):
+			mat = np.stack([self.frame(i) for i in range(*t.indices(self.shape[0]))])
+			return mat[(slice(None),) + rest]
+
+		if t < 0: t += self.shape[0]
+		if not (0 <= t < self.shape[0]): raise IndexError("Frame {} out of range".format(t))
+
+		return self.frame(t)[rest]
+
+	def max(self):
+		# Pairs that are not stored (at least the diagonal) are zeros
+		zero = self.values.dtype.type(0)
+		return zero if self.nnz == 0 else max(np.max(self.values), zero)
+
+	def todense(self):
+		out = np.zeros(self.shape, dtype=self.values.dtype)
+		t = np.repeat(np.arange(self.shape[0]), np.diff(self.offsets))
+		out[t, self.p1, self.p2] = self.values
+		return out
@@ -0,0 +1,61 @@
+import numpy as np
+
+
+def expand_ranges(lo, cnt):
+	"""
+	:return: concatenation of range(lo[k], lo[k] + cnt[k]) for all k
+	"""
+	first = np.repeat(np.cumsum(cnt) - cnt, cnt)
+	return np.repeat(lo, cnt) + np.arange(np.sum(cnt)) - first
+
+
+def near_pairs(XY, valid, radius):
+	"""
+	Pairs of points closer than radius in each frame, found with a uniform grid (cell size = radius)
+	so that only points in neighbouring cells are compared.
+
+	:param XY: N x T x 2 floor positions
+	:param valid: N x T bool. Only these points are paired
+	:param radius: cutoff distance
+	:return: t, p1, p2, dist of every near pair (both (p1, p2) and (p2, p1)), sorted by (t, p1, p2)
+	"""
+	n, t = np.nonzero(valid)
+	pts = XY[n, t]
+
+	ok = np.all(np.isfinite(pts), axis=1)
+	n, t, pts = n[ok], t[ok], pts[ok]
+
+	if len(n) == 0:
+		empty = np.zeros(0, dtype=int)
+		return empty, empty, empty, np.zeros(0, dtype=XY.dtype)
+
+	# Cell index with a margin of one empty cell, so that neighbours never wrap into another row / frame.
+	# Cells are clamped to +-L so that the key fits in int64 : far outliers of the projection share the border cells,
+	# which only adds candidates that the distance test drops (points closer than radius stay in neighbouring cells)
+	L = int(np.sqrt(2. ** 62 / (t.max() + 1))) // 2 - 2
+	cell = np.clip(np.floor(pts / radius), -L, L).astype(np.int64)
+	cell -= cell.min(axis=0) - 1
+	W, H = cell.max(axis=0) + 2
+	key = (t * W + cell[:, 0]) * H + cell[:, 1]
+
+	order = np.argsort(key, kind="stable")
+	key_sorted = key[order]
+
+	i, j = [], []
+	for dx in (-1, 0, 1):
+		for dy in (-1, 0, 1):
+			target = key + dx * H + dy
+			lo = np.searchsorted(key_sorted, target, side="left")
+			cnt = np.searchsorted(key_sorted, target, side="right") - lo
+
+			i.append(np.repeat(np.arange(len(key)), cnt))
+			j.append(order[expand_ranges(lo, cnt)])
+
+	i, j = np.concatenate(i), np.concatenate(j)
+
+	dist = np.sqrt(np.sum(np.power(pts[i] - pts[j], 2), axis=-1))
+	keep = (n[i] != n[j]) & (dist < radius)
+	t, p1, p2, dist = t[i][keep], n[i][keep], n[j][keep], dist[keep]
+
+	order = np.lexsort((p2, p1, t))
+	return t[order], p1[order], p2[order], dist[order]
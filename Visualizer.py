@@ -15,24 +15,26 @@ from NNHandler_openpose import NNHandler_openpose
 
 from suren.util import eprint, progress, Json
 
-try:
-    import matplotlib
-    matplotlib.use('Agg')
-
-    # import networkx as nx
-    import matplotlib.pyplot as plt
-    import matplotlib.cm as cm
-    plt.rc('ytick',labelsize=15)
-    plt.rc('xtick',labelsize=15)
-except ImportError as e:
-    print(e)
+# Loaded by Visualizer.plot_import (matplotlib is slow to import, and only plotting needs it)
+plt = None
 
 
 class Visualizer:
 
+    @staticmethod
+    def plot_import():
+        global plt
+        if plt is not None: return
+        import matplotlib
+        matplotlib.use('Agg')
+
+        import matplotlib.pyplot as plt
+        plt.rc('ytick',labelsize=15)
+        plt.rc('xtick',labelsize=15)
 
     @staticmethod
     def get_cmap(size : list):
+        Visualizer.plot_import()
         if len(size) == 1:
             n = size[0]
             cmap = plt.get_cmap('hsv')
@@ -211,6 +213,7 @@ class Visualizer:
         # MAKE plot
         if self.make_plot:
             assert self.graph is not None, "cannot plot without graph"
+            Visualizer.plot_import()
 
             sc_x_, sc_y_ = self.graph.get_scatter_points()
             xlim, ylim = self.graph.get_plot_lim(sc_x_, sc_y_)
@@ -238,12 +241,14 @@ class Visualizer:
                 self.graph.threat_image_init(fig3, ax3)
 
         if self.img_handle is not None:
-            self.img_handle.open(start_frame=start_time)
+            self.img_handle.open(start_frame=self.start_time)
+            # Frames are decoded in the background while the previous one is drawn
+            frames = self.img_handle.prefetch(self.start_time, self.start_time + self.time_series_length)
 
         for t in range(self.time_series_length):
 
             if self.img_handle is not None:
-                rgb = self.img_handle.read_frame(t)
+                _, rgb = next(frames)
                 rgb_ = rgb.copy()
 
             # ------------------------------- MAKE PLOT ----------------------------------
@@ -394,6 +399,7 @@ class Visualizer:
                 progress(t + 1, self.time_series_length, "drawing graph")
 
         if self.img_handle is not None:
+            frames.close()
             self.img_handle.close()
 
         if self.vid_out_name is not None:
@@ -529,22 +535,15 @@ if __name__ == "__main__":
     # Person handler
     if args.person is not None:
         person_handler = NNHandler_person(args.person, is_tracked=args.track)
-        if os.path.exists(args.person):
-            person_handler.init_from_json()
-        else:
-            person_handler.create_yolo(img_handle)
-            person_handler.save_json()
+        # From json if it exists, else from the detection cache, else YOLO is run on the video (and saved to json)
+        person_handler.create_or_load(img_handle)
     else:
         person_handler = None
 
     # HS handler
     if args.handshake is not None:
         hs_handler = NNHandler_handshake(args.handshake, is_tracked=args.track)
-        if os.path.exists(args.handshake):
-            hs_handler.init_from_json()
-        else:
-            hs_handler.create_yolo(img_handle)
-            hs_handler.save_json()
+        hs_handler.create_or_load(img_handle)
     else:
         hs_handler = None
 
@@ -556,8 +555,10 @@ if __name__ == "__main__":
         g = Graph()
         g.getCameraInfoFromJson(args.cam)
 
-        if os.path.exists(args.graph):
-            g.init_from_json(args.graph)
+        # Only frames [start_time, end_time) of a stored graph are loaded : it is not saved back over itself
+        loaded_window = os.path.exists(args.graph)
+        if loaded_window:
+            g.init_from_json(args.graph, start_time, end_time)
 
         print("State = ", g.state)
 
@@ -578,7 +579,9 @@ if __name__ == "__main__":
         if g.state["threat"] < 2:
             g.calculateThreatLevel()
 
-        if args.overwrite_graph:
+        if args.overwrite_graph and loaded_window:
+            eprint("Graph loaded for frames [%d, %d) only. Not saved over %s" % (start_time, end_time, args.graph))
+        elif args.overwrite_graph:
             g.saveToFile(args.graph)
     else:
         g = None
@@ -0,0 +1,74 @@
+import argparse
+import time
+import numpy as np
+
+import common		# puts the repository on the path
+from NNHandler_person import NNHandler_person
+from DetectorBackend import FixedDetector, SyntheticCrowd, SyntheticTracker, SyntheticVideo
+
+
+class IndexedVideo(SyntheticVideo):
+	""" Frames filled with their index (mod 256), so that the tracker can check it gets the right one """
+
+	def prefetch(self, start_frame=None, end_frame=None, **kwargs):
+		for t, _ in super().prefetch(start_frame, end_frame, **kwargs):
+			yield t, np.full((4, 4, 3), t % 256, dtype=np.uint8)
+
+
+class RecordingTracker(SyntheticTracker):
+	""" Records the frames it is given, in call order """
+
+	def __init__(self, crowd):
+		super().__init__(crowd)
+		self.frames = []
+
+	def update(self, t, frame, detections):
+		assert frame[0, 0, 0] == t % 256, "Frame %d got the image of frame %d" % (t, frame[0, 0, 0])
+		assert len(detections[0]) == 2, "Frame %d did not get the detector output" % t
+		self.frames.append(t)
+		return super().update(t, frame, detections)
+
+
+def run(n_frames, batch_size, crowd):
+	"""
+	create_yolo with a FixedDetector (2 boxes per frame) and a RecordingTracker
+	:return: handler, detector, tracker, seconds
+	"""
+	detector = FixedDetector([[10, 10, 20, 40], [50, 10, 20, 40]])
+	tracker = RecordingTracker(crowd)
+	handler = NNHandler_person(vis=False, verbose=False)
+
+	t = time.perf_counter()
+	handler.create_yolo(IndexedVideo(n_frames, width=crowd.width, height=crowd.height), batch_size=batch_size,
+						detector=detector, tracker=tracker)
+	return handler, detector, tracker, time.perf_counter() - t
+
+
+# Checks the batching of NNHandler_yolo.create_yolo (DetectorBackend.detect_batches) : the detector gets batches of
+# batch_size frames (the last one shorter), and the tracker still gets every frame once, in order, with its detections
+# 	python bench_batching.py --frames 20 --batch 1 3 7
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Check the batched detection of create_yolo (FixedDetector)")
+	parser.add_argument("--frames", type=int, default=20)
+	parser.add_argument("--batch", "-b", type=int, nargs="*", default=[1, 3, 7])
+	args = parser.parse_args()
+
+	crowd = SyntheticCrowd(n_people=5, seed=0)
+	reference = None
+	for batch_size in args.batch:
+		handler, detector, tracker, sec = run(args.frames, batch_size, crowd)
+
+		expected = [batch_size] * (args.frames // batch_size) + ([args.frames % batch_size] if args.frames % batch_size else [])
+		assert detector.batch_sizes == expected, "Batch sizes %s, expected %s" % (detector.batch_sizes, expected)
+		assert detector.calls == len(expected)
+		assert tracker.frames == list(range(args.frames)), "Tracker frames out of order : %s" % tracker.frames
+		assert handler.time_series_length == args.frames
+
+		# Batching does not change the output
+		if reference is None: reference = handler.json_data
+		assert handler.json_data == reference, "Detections differ with batch size %d" % batch_size
+
+		print("batch %3d : %3d detector calls (%s), %.3f s" % (batch_size, detector.calls, ",".join(map(str, sorted(set(expected)))), sec))
+
+	print("Batching OK")
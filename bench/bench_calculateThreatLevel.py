@@ -0,0 +1,22 @@
+import numpy as np
+
+from common import get_parse, load_graph, timeit
+
+
+if __name__ == "__main__":
+	args = get_parse("Compare NAIVE and VECTORIZED Graph.calculateThreatLevel").parse_args()
+
+	g = load_graph(args)
+	g.generateFloorMap()
+	g.findClusters(METHOD="VECTORIZED")
+	print("Nodes = %d, Frames = %d" % (g.n_nodes, g.time_series_length))
+
+	res = {}
+	for method in ["NAIVE", "VECTORIZED"]:
+		t = timeit(lambda: g.calculateThreatLevel(METHOD=method), args.repeat)
+		res[method] = [g.pairD, g.pairI, g.pairM, g.pairG, g.pairT, g.frameThreatLevel]
+		print("%-12s : %.4f s" % (method, t))
+
+	for name, a, b in zip(["pairD", "pairI", "pairM", "pairG", "pairT", "frameThreatLevel"], res["NAIVE"], res["VECTORIZED"]):
+		assert np.array_equal(a, b), "%s mismatch" % name
+	print("Results match")
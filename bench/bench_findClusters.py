@@ -0,0 +1,21 @@
+import numpy as np
+
+from common import get_parse, load_graph, timeit
+
+
+if __name__ == "__main__":
+	args = get_parse("Compare NAIVE and VECTORIZED Graph.findClusters").parse_args()
+
+	g = load_graph(args, handshake=False)
+	g.generateFloorMap()
+	print("Nodes = %d, Frames = %d" % (g.n_nodes, g.time_series_length))
+
+	res = {}
+	for method in ["NAIVE", "VECTORIZED"]:
+		t = timeit(lambda: g.findClusters(METHOD=method), args.repeat)
+		res[method] = (g.groupProbability.copy(), g.pairDetectionProbability.copy())
+		print("%-12s : %.4f s" % (method, t))
+
+	assert np.array_equal(res["NAIVE"][0], res["VECTORIZED"][0]), "groupProbability mismatch"
+	assert np.array_equal(res["NAIVE"][1], res["VECTORIZED"][1]), "pairDetectionProbability mismatch"
+	print("Results match")
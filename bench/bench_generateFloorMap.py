@@ -0,0 +1,24 @@
+import numpy as np
+
+from common import get_parse, load_graph, timeit
+
+
+if __name__ == "__main__":
+	parser = get_parse("Compare NAIVE and VECTORIZED Graph.generateFloorMap")
+	parser.add_argument("--columnar", action="store_true", help="Columnar node storage")
+	args = parser.parse_args()
+
+	res = {}
+	for method in ["NAIVE", "VECTORIZED"]:
+		times = []
+		for _ in range(args.repeat):
+			g = load_graph(args, handshake=False)
+			if args.columnar: g.make_columnar()
+			times.append(timeit(lambda: g.generateFloorMap(METHOD=method), 1))
+
+		res[method] = g.projectedFloorMapNTXY
+		print("%-12s : %.4f s" % (method, min(times)))
+
+	print("Nodes = %d, Frames = %d" % (g.n_nodes, g.time_series_length))
+	assert np.array_equal(res["NAIVE"], res["VECTORIZED"]), "projectedFloorMapNTXY mismatch"
+	print("Results match")
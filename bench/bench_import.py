@@ -0,0 +1,44 @@
+import argparse
+import subprocess
+import sys
+
+from common import ROOT
+
+# Analysis modules must not pull in the packages of the detectors (TensorFlow, deepsort) or of the plots (matplotlib)
+# when imported : these are loaded by create_yolo and the plotting methods
+MODULES = ["Graph", "OnlineGraph", "NNHandler_person", "NNHandler_handshake", "NNHandler_openpose", "Visualizer"]
+HEAVY = ["tensorflow", "deep_sort", "matplotlib", "mpl_toolkits"]
+
+CODE = """
+import sys, time
+t = time.perf_counter()
+import {}
+t = time.perf_counter() - t
+print(t, ",".join(m for m in {} if m in sys.modules))
+"""
+
+
+def import_time(module):
+	""" Import time (s) of module in a new interpreter, and the heavy packages it loaded """
+	out = subprocess.run([sys.executable, "-c", CODE.format(module, HEAVY)], cwd=ROOT, check=True,
+						 stdout=subprocess.PIPE, universal_newlines=True).stdout.split()
+	return float(out[0]), out[1:]
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Import time of the analysis modules (fresh interpreter per run)")
+	parser.add_argument("--repeat", "-r", type=int, default=3)
+	parser.add_argument("--limit", "-l", type=float, default=1., help="Fail if a module takes longer (s)")
+	parser.add_argument("modules", nargs="*", default=MODULES)
+	args = parser.parse_args()
+
+	failed = False
+	for module in args.modules:
+		runs = [import_time(module) for _ in range(args.repeat)]
+		best = min(t for t, _ in runs)
+		heavy = runs[0][1]
+
+		print("%-22s : %.3f s %s" % (module, best, ("(loads %s)" % heavy[0]) if heavy else ""))
+		failed |= best > args.limit or bool(heavy)
+
+	sys.exit(1 if failed else 0)
@@ -0,0 +1,78 @@
+import gc
+import tracemalloc
+import numpy as np
+
+from common import get_parse, load_graph
+from Graph import Graph
+from NNHandler_person import NNHandler_person
+from NNHandler_handshake import NNHandler_handshake
+from DetectorBackend import SyntheticCrowd, SyntheticDetector, SyntheticTracker, SyntheticVideo
+
+
+def synthetic_graph(args):
+	""" Graph (people + handshakes) of a SyntheticCrowd of args.people over args.frames frames """
+	crowd = SyntheticCrowd(n_people=args.people, handshake_rate=args.rate, seed=args.seed)
+	video = SyntheticVideo(args.frames, width=crowd.width, height=crowd.height)
+
+	person_handle = NNHandler_person(vis=False, verbose=False)
+	person_handle.create_yolo(video, batch_size=8, detector=SyntheticDetector(crowd, "person"),
+							  tracker=SyntheticTracker(crowd, "person"))
+	hs_handle = NNHandler_handshake(vis=False, verbose=False)
+	hs_handle.create_yolo(video, batch_size=8, detector=SyntheticDetector(crowd, "handshake"),
+						  tracker=SyntheticTracker(crowd, "handshake"))
+
+	g = Graph()
+	g.getCameraInfoFromJson(args.cam)
+	person_handle.connectToGraph(g)
+	person_handle.runForBatch()
+	hs_handle.connectToGraph(g)
+	hs_handle.runForBatch()
+	return g
+
+
+def measure(make, columnar):
+	"""
+	Bytes held by the graph of make() after generateFloorMap (list or columnar nodes)
+	:return: graph, bytes
+	"""
+	gc.collect()
+	tracemalloc.start()
+	g = make()
+	g.generateFloorMap(METHOD="VECTORIZED")
+	if columnar: g.make_columnar()
+	gc.collect()
+	size = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return g, size
+
+
+# Memory of the node time series as Python lists (default) and as N x T columns (Graph.make_columnar), with the
+# analysis results of both. Handshakes are the bulk of list mode : a dict per node and frame.
+# 	python bench_memory.py								(DEEE labels)
+# 	python bench_memory.py --people 200 --frames 2000		(SyntheticCrowd)
+
+if __name__ == "__main__":
+	parser = get_parse("Memory of list and columnar node storage")
+	parser.add_argument("--people", type=int, default=None, help="Synthetic crowd of this size instead of the labels")
+	parser.add_argument("--frames", type=int, default=2000, help="(--people) frames")
+	parser.add_argument("--rate", type=float, default=.05, help="(--people) new handshakes per frame")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+
+	make = (lambda: load_graph(args)) if args.people is None else (lambda: synthetic_graph(args))
+
+	res = {}
+	for name, columnar in [("lists", False), ("columnar", True)]:
+		g, size = measure(make, columnar)
+		cells = g.n_nodes * g.time_series_length
+		print("%-10s : %8.1f MB, %6.1f bytes per node frame" % (name, size / 1e6, size / cells))
+
+		g.findClusters(METHOD="VECTORIZED")
+		g.calculateThreatLevel(METHOD="VECTORIZED")
+		res[name] = (size, [g.projectedFloorMapNTXY, g.groupProbability, g.frameThreatLevel])
+
+	print("Nodes = %d, Frames = %d" % (g.n_nodes, g.time_series_length))
+	print("Columnar uses %.1fx less memory" % (res["lists"][0] / res["columnar"][0]))
+	for a, b in zip(res["lists"][1], res["columnar"][1]):
+		assert np.array_equal(a, b), "Analysis results differ between list and columnar nodes"
+	print("Results match")
@@ -0,0 +1,80 @@
+import numpy as np
+
+from common import get_parse, load_graph, timeit
+from Graph import Graph
+from NNHandler_person import NNHandler_person
+from DetectorBackend import SyntheticCrowd, SyntheticDetector, SyntheticTracker, SyntheticVideo
+
+
+def synthetic_graph(args, n_people):
+	"""
+	Graph of a SyntheticCrowd of n_people over args.frames frames, seen from above (floor units = pixels).
+	The scene grows with the crowd (args.area floor units per person), so the neighbours of each person do not
+	"""
+	side = int(np.sqrt(n_people * args.area))
+	crowd = SyntheticCrowd(n_people=n_people, width=side, height=side, handshake_rate=.05, seed=args.seed)
+	video = SyntheticVideo(args.frames, width=crowd.width, height=crowd.height)
+
+	person_handle = NNHandler_person(vis=False, verbose=False)
+	person_handle.create_yolo(video, batch_size=8, detector=SyntheticDetector(crowd), tracker=SyntheticTracker(crowd))
+
+	g = Graph()
+	g.getCameraInfoFromJson(args.cam)
+	g.transMatrix = np.eye(3)
+	g.N_WORKERS = args.workers if args.workers > 0 else None
+	person_handle.connectToGraph(g)
+	person_handle.runForBatch()
+	return g
+
+
+def compare(g, cutoff, repeat):
+	"""
+	Time findClusters + calculateThreatLevel with all co-detected pairs and with the grid neighbour search
+	:return: {name : (findClusters s, calculateThreatLevel s)}
+	"""
+	g.generateFloorMap()
+	g.SPARSE_PAIRS = True
+
+	res, times = {}, {}
+	for name, val in [("all pairs", None), ("grid", cutoff)]:
+		g.NEIGHBOR_CUTOFF = val
+		t1 = timeit(lambda: g.findClusters(METHOD="VECTORIZED"), repeat)
+		t2 = timeit(lambda: g.calculateThreatLevel(METHOD="VECTORIZED"), repeat)
+		res[name] = [g.groupProbability, g.frameThreatLevel]
+		times[name] = (t1, t2)
+		print("\t%-12s : findClusters %.4f s, calculateThreatLevel %.4f s, %d pair entries" % (name, t1, t2, g.pairT.nnz))
+
+	assert np.array_equal(res["all pairs"][0], res["grid"][0]), "groupProbability mismatch"
+	print("\tgroupProbability match. Max frameThreatLevel difference : %.6f" % np.max(np.abs(res["all pairs"][1] - res["grid"][1])))
+	return times
+
+
+# The grid only pays off when the cutoff leaves out most pairs : many people on a floor several cutoffs wide.
+# With the few people of the DEEE labels, on a floor about two cutoffs wide, comparing all co-detected pairs is cheaper.
+# 	python bench_neighbors.py								(DEEE labels)
+# 	python bench_neighbors.py --people 100 200 400 800		(SyntheticCrowd of each size)
+
+if __name__ == "__main__":
+	parser = get_parse("Compare all co-detected pairs with the grid neighbour search (Graph.NEIGHBOR_CUTOFF)")
+	parser.add_argument("--cutoff", type=float, default=None, help="Default : 4 * DISTANCE_TAU")
+	parser.add_argument("--people", type=int, nargs="*", default=None, help="Synthetic crowds of these sizes instead of the labels")
+	parser.add_argument("--frames", type=int, default=50, help="(--people) frames of each crowd")
+	parser.add_argument("--area", type=float, default=400. ** 2, help="(--people) floor area per person")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+
+	if args.people is None:
+		graphs = [("labels", lambda: load_graph(args))]
+	else:
+		graphs = [("%d people" % n, lambda n=n: synthetic_graph(args, n)) for n in args.people]
+
+	summary = []
+	for name, make in graphs:
+		g = make()
+		cutoff = 4 * g.DISTANCE_TAU if args.cutoff is None else args.cutoff
+		print("%s : Nodes = %d, Frames = %d, Cutoff = %.1f" % (name, g.n_nodes, g.time_series_length, cutoff))
+		times = compare(g, cutoff, args.repeat)
+		summary.append((name, sum(times["all pairs"]) / sum(times["grid"])))
+
+	for name, speedup in summary:
+		print("%-12s : grid %.2fx %s" % (name, speedup, "faster" if speedup >= 1 else "slower"))
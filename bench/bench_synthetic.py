@@ -0,0 +1,51 @@
+import time
+
+from common import get_parse
+from Graph import Graph
+from NNHandler_person import NNHandler_person
+from NNHandler_handshake import NNHandler_handshake
+from DetectorBackend import SyntheticCrowd, SyntheticDetector, SyntheticTracker, SyntheticVideo
+
+
+def stage(name, func):
+	t = time.perf_counter()
+	out = func()
+	print("%-22s : %.3f s" % (name, time.perf_counter() - t))
+	return out
+
+
+if __name__ == "__main__":
+	parser = get_parse("Person -> handshake -> graph pipeline on a synthetic crowd (no models or videos needed)")
+	parser.add_argument("--people", type=int, default=50)
+	parser.add_argument("--frames", type=int, default=2000)
+	parser.add_argument("--rate", type=float, default=.05, help="New handshakes per frame")
+	parser.add_argument("--batch", "-b", type=int, default=8, help="Frames per detector call")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+
+	crowd = SyntheticCrowd(n_people=args.people, handshake_rate=args.rate, seed=args.seed)
+	video = SyntheticVideo(args.frames, width=crowd.width, height=crowd.height)
+	print("People = %d, Frames = %d, Handshake rate = %.3f" % (args.people, args.frames, args.rate))
+
+	person_handle = NNHandler_person(vis=False, verbose=False)
+	stage("person detection", lambda: person_handle.create_yolo(video, batch_size=args.batch,
+		detector=SyntheticDetector(crowd, "person"), tracker=SyntheticTracker(crowd, "person")))
+
+	hs_handle = NNHandler_handshake(vis=False, verbose=False)
+	stage("handshake detection", lambda: hs_handle.create_yolo(video, batch_size=args.batch,
+		detector=SyntheticDetector(crowd, "handshake"), tracker=SyntheticTracker(crowd, "handshake")))
+	print("Handshakes = %d" % crowd.n_shakes)
+
+	g = Graph()
+	g.getCameraInfoFromJson(args.cam)
+	g.N_WORKERS = args.workers if args.workers > 0 else None
+
+	person_handle.connectToGraph(g)
+	stage("graph (people)", lambda: person_handle.runForBatch())
+	hs_handle.connectToGraph(g)
+	stage("graph (handshakes)", lambda: hs_handle.runForBatch())
+	print("Nodes = %d" % g.n_nodes)
+
+	stage("generateFloorMap", lambda: g.generateFloorMap(METHOD="VECTORIZED"))
+	stage("findClusters", lambda: g.findClusters(METHOD="VECTORIZED"))
+	stage("calculateThreatLevel", lambda: g.calculateThreatLevel(METHOD="VECTORIZED"))
@@ -0,0 +1,58 @@
+import os, sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from Graph import Graph
+from NNHandler_person import NNHandler_person
+from NNHandler_handshake import NNHandler_handshake
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def get_parse(description=None):
+	import argparse
+
+	parser = argparse.ArgumentParser(description=description)
+	parser.add_argument("--person", "-p", type=str, default=ROOT + "/data/labels/DEEE/yolo/cctv9-yolo.json")
+	parser.add_argument("--handshake", "--hs", type=str, default=ROOT + "/data/labels/DEEE/handshake/cctv9-hs.json")
+	parser.add_argument("--cam", "-c", type=str, default=ROOT + "/data/camera-orientation/jsons/deee.json")
+	parser.add_argument("--start_time", "-st", type=int, default=0)
+	parser.add_argument("--end_time", "-et", type=int, default=None)
+	parser.add_argument("--repeat", "-r", type=int, default=3)
+	parser.add_argument("--workers", "-w", type=int, default=1, help="Graph.N_WORKERS (0 : all cores)")
+	return parser
+
+
+def load_graph(args, handshake=True):
+	""" Build a graph (people + handshakes) from the label files in args """
+	person_handle = NNHandler_person(args.person, verbose=False)
+	person_handle.init_from_json()
+
+	g = Graph()
+	g.getCameraInfoFromJson(args.cam)
+	g.N_WORKERS = args.workers if args.workers > 0 else None
+
+	end_time = person_handle.time_series_length if args.end_time is None else args.end_time
+
+	person_handle.connectToGraph(g)
+	person_handle.runForBatch(args.start_time, end_time)
+
+	if handshake and args.handshake is not None:
+		hs_handle = NNHandler_handshake(args.handshake, verbose=False)
+		hs_handle.init_from_json()
+		hs_handle.connectToGraph(g)
+		hs_handle.runForBatch(args.start_time, end_time)
+
+	return g
+
+
+def timeit(func, repeat=3):
+	""" Best wall time (s) of func() over repeat runs """
+	best = None
+	for _ in range(repeat):
+		t = time.perf_counter()
+		func()
+		t = time.perf_counter() - t
+		best = t if best is None else min(best, t)
+	return best
@@ -0,0 +1,18 @@
+import argparse
+
+from Graph import Graph
+
+# Convert graphs between the json format (Graph.saveToFile) and the binary format (Graph.saveToBinary)
+# 	python convert_graph.py -i data/temp/deee-cctv5.json -o data/temp/deee-cctv5.graph
+# 	python convert_graph.py -i data/temp/deee-cctv5.graph -o data/temp/deee-cctv5.json
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--input", "-i", type=str, dest="input", required=True)
+	parser.add_argument("--output", "-o", type=str, dest="output", required=True)
+	args = parser.parse_args()
+
+	if args.input.endswith(".json"):
+		Graph.json_to_binary(args.input, args.output)
+	else:
+		Graph.binary_to_json(args.input, args.output)
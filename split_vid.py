@@ -20,14 +20,10 @@ i = 0
 out = NNHandler_image(format="avi")
 out.init_writer(out_name=out_prefix + "{}.avi".format(ind), h=vid.height, w=vid.width)
 
-while True:
+# Frames are decoded in the background while the previous ones are encoded
+for _, frame in vid.prefetch():
 
-    frame = vid.read_frame()
-    if frame is None:
-        out.close_writer()
-        break
-    else:
-        out.write_frame(frame)
+    out.write_frame(frame)
 
     if (i != 0 and i%1800 == 0):
         out.close_writer()
@@ -38,5 +34,5 @@ while True:
 
     i += 1
 
-
+out.close_writer()
 vid.close()
@@ -5,32 +5,62 @@ import configparser
 
 import os
 import sys
+import time
 import numpy as np
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 class Json():
+    """
+    compact : no indentation or spaces (default is indent=4, as the files in data/)
+    fast : encode with orjson when it is installed. NaN / inf are written as null, and indent is 2
+    Set Json.compact / Json.fast to change the default of every handler
+    """
+    compact = False
+    fast = False
 
-    def __init__(self, name, OW=False, verbose=True):
+    def __init__(self, name, OW=False, verbose=True, compact=None, fast=None):
         self.name = name
+        if compact is not None: self.compact = compact
+        if fast is not None: self.fast = fast
 
-        if os.path.exists(name) and OW==False:
-            if verbose: print("json file exists")
-        else:
+        # The file is only written by write()
+        self.new = OW or not os.path.exists(name)
+        if self.new:
             if verbose: print("creating json file")
-            self.write({})
+        else:
+            if verbose: print("json file exists")
+
+    def dumps(self, data):
+        """ Serialize data once (raises before the file is touched if it is not serializable) """
+        if self.fast and orjson is not None:
+            option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+            if not self.compact: option |= orjson.OPT_INDENT_2
+            return orjson.dumps(data, option=option)
+
+        if self.compact:
+            return json.dumps(data, separators=(',', ':')).encode()
+        return json.dumps(data, indent=4).encode()
 
     def write(self, data):
-        Json.is_jsonable(data)  # Check if data is serializable
+        # One shot encoding (C encoder) is faster than json.dump, which streams through the python encoder
+        out = self.dumps(data)
 
-        with open(self.name, 'w+') as outfile:
-            json.dump(data, outfile, indent=4)
+        with open(self.name, 'wb') as outfile:
+            outfile.write(out)
+        self.new = False
 
 
     def read(self):
+        if self.new: return {}
+
         with open(self.name, 'r') as file:
-            if len(file.readlines()) != 0: file.seek(0)
             data = json.load(file)
         return data
 
@@ -53,6 +83,221 @@ class Json():
         except Exception as e:
             raise Exception(e)
 
+class JsonStream():
+    """
+    Incremental reader of the detector json files ({"frames": N, "0": [...], "1": [...], ...}).
+    Frames are parsed one at a time, so memory is bounded by the largest frame and not by the file.
+    Entries that are not frames ("frames", ...) are kept in self.header
+    """
+
+    def __init__(self, name, chunk_size=1 << 20):
+        self.name = name
+        self.chunk_size = chunk_size
+        self.header = {}
+
+    def read_header(self):
+        """ Entries before the first frame (save_json writes "frames" first) """
+        for _ in self:
+            break
+        return self.header
+
+    def __iter__(self):
+        """
+        :return: iterator of (frame_index, detections) in frame order
+        """
+        decoder = json.JSONDecoder()
+
+        with open(self.name, 'r') as file:
+            buf, pos, eof = '', 0, False
+
+            def more():
+                nonlocal buf, pos, eof
+                chunk = file.read(self.chunk_size)
+                eof = len(chunk) == 0
+                buf, pos = buf[pos:] + chunk, 0
+
+            def token():
+                # Next non white space character
+                nonlocal pos
+                while True:
+                    while pos < len(buf) and buf[pos] in ' \t\n\r': pos += 1
+                    if pos < len(buf): return buf[pos]
+                    if eof: raise ValueError("Unexpected end of json file : %s" % self.name)
+                    more()
+
+            def value():
+                nonlocal pos
+                token()
+                while True:
+                    try:
+                        val, end = decoder.raw_decode(buf, pos)
+                        # A value that ends with the buffer (a number) may continue in the next chunk
+                        if end < len(buf) or eof:
+                            pos = end
+                            return val
+                    except json.JSONDecodeError:
+                        if eof: raise
+                    more()
+
+            if token() != '{': raise ValueError("Not a json object : %s" % self.name)
+            pos += 1
+
+            last = None
+            while True:
+                c = token()
+                if c == '}': return
+                if c == ',':
+                    pos += 1
+                    continue
+
+                key = value()
+                if token() != ':': raise ValueError("Expected ':' after key %s in %s" % (key, self.name))
+                pos += 1
+                val = value()
+
+                if key.lstrip('-').isdigit():
+                    t = int(key)
+                    if last is not None and t <= last:
+                        raise ValueError("Frames of %s are not in order (%d after %d)" % (self.name, t, last))
+                    last = t
+                    yield t, val
+                else:
+                    self.header[key] = val
+
+
+class JsonLines():
+    """
+    Append only detector output : one line per frame ({"frame": t, "detections": [...]}) and, once complete,
+    a last line {"frames": N}. Lines are flushed every flush_every frames, so the file can be read (follow=True tails it)
+    while it is being written, and a crashed run can resume after the last complete line.
+    """
+
+    def __init__(self, name, flush_every=100, follow=False, poll=0.5):
+        """
+        :param follow: (reading) wait for new lines until the {"frames": N} line is written
+        :param poll: (reading) seconds between checks for new lines when following
+        """
+        self.name = name
+        self.flush_every = flush_every
+        self.follow = follow
+        self.poll = poll
+
+        self.header = {}
+        self.file = None
+        self.last_frame = -1    # last frame written
+        self.max_id = -1        # largest detection id written
+        self.n_lines = 0
+
+    def open(self, resume=False):
+        """
+        :param resume: Keep the complete frame lines of an existing file (a partial last line is dropped)
+        :return: first frame to write
+        """
+        self.last_frame, self.max_id, self.n_lines = -1, -1, 0
+
+        if resume and os.path.exists(self.name):
+            end = 0
+            with open(self.name, 'rb') as file:
+                for line in file:
+                    try:
+                        obj = json.loads(line) if line.endswith(b'\n') else None
+                    except ValueError:
+                        obj = None
+                    if obj is None or "frame" not in obj: break     # partial line, or the end line (close() rewrites it)
+
+                    self.last_frame = obj["frame"]
+                    self.max_id = max([self.max_id] + [d["id"] for d in obj["detections"] if "id" in d])
+                    end += len(line)
+
+            self.file = open(self.name, 'r+b')
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = open(self.name, 'wb')
+
+        return self.last_frame + 1
+
+    def write(self, t, detections):
+        assert t > self.last_frame, "Frames must be written in order (%d after %d)" % (t, self.last_frame)
+
+        self.file.write((json.dumps({"frame": t, "detections": detections}, separators=(',', ':')) + '\n').encode())
+        self.last_frame = t
+        self.n_lines += 1
+        if self.n_lines % self.flush_every == 0: self.file.flush()
+
+    def close(self, frames=None):
+        """
+        :param frames: Number of frames of the video. Marks the file as complete
+        """
+        if self.file is None: return
+        if frames is not None:
+            self.file.write((json.dumps({"frames": frames}) + '\n').encode())
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read_header(self):
+        """
+        The {"frames": N} line, if the file is complete (read from the end of the file).
+        Otherwise (still being written, or interrupted) last_frame is set to the last complete frame line
+        """
+        with open(self.name, 'rb') as file:
+            size = file.seek(0, os.SEEK_END)
+            block = 4096
+            while True:
+                start = max(0, size - block)
+                file.seek(start)
+                lines = file.read().split(b'\n')[:-1]     # after the last newline : partial line (or nothing)
+                if start > 0: lines = lines[1:]         # may start mid line
+                if lines or start == 0: break
+                block *= 2                              # longer line than the block
+
+        for line in reversed(lines):
+            if not line.strip(): continue
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                break
+            if "frame" in obj: self.last_frame = obj["frame"]
+            else: self.header = obj
+            break
+        return self.header
+
+    def frames(self):
+        """ Frames of the video if the file is complete, else the frames written so far (last frame + 1) """
+        header = self.read_header()
+        return header["frames"] if "frames" in header else self.last_frame + 1
+
+    def __iter__(self):
+        """
+        :return: iterator of (frame_index, detections) in frame order
+        """
+        with open(self.name, 'rb') as file:
+            buf = b''
+            while True:
+                line = file.readline()
+                if line.endswith(b'\n'):
+                    obj = json.loads(buf + line)
+                    buf = b''
+                    if "frame" in obj:
+                        yield obj["frame"], obj["detections"]
+                    else:
+                        self.header = obj
+                        return
+
+                elif self.follow:
+                    buf += line             # The rest of the line is not written yet
+                    time.sleep(self.poll)
+
+                else:
+                    return
+
+
 def get_iou(bb1, bb2, mode=0):
     """
     Calculate the Intersection over Union (IoU) of two bounding boxes.
@@ -150,6 +395,27 @@ def iou_batch(bb_test, bb_gt):
     return (o)
 
 
+def iou_pairs(bb_a, bb_b, mode=0):
+    """
+    IOU of bb_a[i] and bb_b[i] for each i (same formula as iou_batch, without the all pairs expansion)
+    :param mode: 0 - intersection over union, 1 - intersection over area of bb_a (as get_iou)
+    """
+    bb_a = np.asarray(bb_a, dtype=float)
+    bb_b = np.asarray(bb_b, dtype=float)
+
+    xx1 = np.maximum(bb_a[..., 0], bb_b[..., 0])
+    yy1 = np.maximum(bb_a[..., 1], bb_b[..., 1])
+    xx2 = np.minimum(bb_a[..., 2], bb_b[..., 2])
+    yy2 = np.minimum(bb_a[..., 3], bb_b[..., 3])
+    w = np.maximum(0., xx2 - xx1)
+    h = np.maximum(0., yy2 - yy1)
+    wh = w * h
+    area_a = (bb_a[..., 2] - bb_a[..., 0]) * (bb_a[..., 3] - bb_a[..., 1])
+    if mode:
+        return wh / area_a
+    return wh / (area_a + (bb_b[..., 2] - bb_b[..., 0]) * (bb_b[..., 3] - bb_b[..., 1]) - wh)
+
+
 
 
 def read_ini(file_path, config_json):